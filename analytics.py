@@ -3,33 +3,200 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
+import atexit
+import logging
+import queue
+import threading
+import time
 from datetime import datetime, timedelta
-from supabase import Client
+from itertools import chain
+from supabase import Client, PostgrestAPIError
 
-def save_game_run(supabase: Client, user_name, email, predictions, random_numbers, score, game_type="1-99_range_10_numbers"):
-    """Save individual game run for analytics"""
+logger = logging.getLogger(__name__)
+
+# Number category masks, indexed by number (index 0 is unused)
+_NUMBERS = np.arange(100)
+_PRIMES = frozenset({2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97})
+_PRIME_MASK = np.isin(_NUMBERS, list(_PRIMES))
+_EVEN_MASK = (_NUMBERS % 2 == 0) & (_NUMBERS >= 1)
+_LUCKY7_MASK = _NUMBERS % 10 == 7                      # 7, 17, 27, ..., 97
+_UNLUCKY13_MASK = np.isin(_NUMBERS, [13, 31])
+_REPEAT_MASK = (_NUMBERS % 11 == 0) & (_NUMBERS >= 1)  # 11, 22, 33, ..., 99
+_MULT5_MASK = (_NUMBERS % 5 == 0) & (_NUMBERS >= 1)
+_MULT10_MASK = (_NUMBERS % 10 == 0) & (_NUMBERS >= 1)
+_SMALL_MASK = (_NUMBERS >= 1) & (_NUMBERS <= 33)
+_MEDIUM_MASK = (_NUMBERS >= 34) & (_NUMBERS <= 66)
+_LARGE_MASK = _NUMBERS >= 67
+
+# Minimum games before the heavier charts are worth building
+MIN_GAMES_FOR_HEATMAPS = 30
+MIN_GAMES_FOR_PATTERNS = 50
+
+# PostgREST/Postgres error codes for a function, table or view that doesn't exist -
+# the only errors that mean "not installed yet, use the client-side fallback"
+_MISSING_OBJECT_CODES = frozenset({'PGRST202', 'PGRST205', '42883', '42P01'})
+
+# Game runs are written in batches by a background thread (see start_game_run_writer)
+GAME_RUN_FLUSH_SECONDS = 2
+GAME_RUN_BATCH_SIZE = 100
+# A run that fails this many writes is dropped (and logged) instead of retried forever
+GAME_RUN_MAX_ATTEMPTS = 5
+GAME_RUN_MAX_BACKOFF_SECONDS = 60
+# How long shutdown waits for the last batch to be written
+GAME_RUN_SHUTDOWN_SECONDS = 10
+# Items are (failed attempts, run) pairs; None tells the writer to finish up
+_game_run_queue = queue.Queue()
+# Set at shutdown to cut a retry backoff short
+_game_run_writer_stopping = threading.Event()
+_game_run_writer = None
+_game_run_writer_lock = threading.Lock()
+
+def _raise_unless_missing(error):
+    """Re-raise the error unless it says a database function, table or view isn't installed"""
+    if not (isinstance(error, PostgrestAPIError) and error.code in _MISSING_OBJECT_CODES):
+        raise error
+
+def save_game_run(user_name, email, predictions, random_numbers, score, game_type="1-99_range_10_numbers"):
+    """Queue individual game run for analytics - the writer thread saves it"""
+    # Normalize email to lowercase to ensure consistency
+    normalized_email = email.strip().lower()
+    _game_run_queue.put((0, {
+        'user_name': user_name,
+        'email': normalized_email,
+        'predictions': predictions,
+        'random_numbers': random_numbers,
+        'score': score,
+        'game_type': game_type
+    }))
+
+def start_game_run_writer(supabase: Client):
+    """Start the background thread that writes queued game runs (once per process)"""
+    global _game_run_writer
+    with _game_run_writer_lock:
+        # init_supabase can run again after its cache is cleared - keep the one writer
+        if _game_run_writer is not None:
+            return
+        _game_run_writer = threading.Thread(target=_write_game_runs, args=(supabase,), daemon=True, name="game-run-writer")
+        _game_run_writer.start()
+        # Save whatever is still queued when the server shuts down
+        atexit.register(_stop_game_run_writer)
+
+def _stop_game_run_writer():
+    """Have the writer save the rest of the queue, then wait for it to finish"""
+    _game_run_writer_stopping.set()
+    _game_run_queue.put(None)
+    _game_run_writer.join(timeout=GAME_RUN_SHUTDOWN_SECONDS)
+    if _game_run_writer.is_alive():
+        # Still writing its last batch - anything it hasn't taken off the queue is lost
+        unsaved = sum(item is not None for item in list(_game_run_queue.queue))
+        logger.error("Game run writer did not finish in %ds, %d queued game runs not saved",
+                     GAME_RUN_SHUTDOWN_SECONDS, unsaved)
+
+def _write_game_runs(supabase: Client):
+    """Insert queued game runs in batches, one request per GAME_RUN_FLUSH_SECONDS at most"""
+    while True:
+        try:
+            batch, stopping = _next_game_run_batch()
+            failed = _insert_game_runs(supabase, batch, requeue=not stopping)
+            if stopping:
+                return
+            if failed:
+                # Back off before the failed runs come round again (shutdown ends the wait early)
+                _game_run_writer_stopping.wait(min(2 ** max(attempts for attempts, _ in failed), GAME_RUN_MAX_BACKOFF_SECONDS))
+        except Exception:
+            # Keep the writer alive whatever happens - a dead thread would stop all writes
+            logger.exception("Game run writer error")
+
+def _next_game_run_batch():
+    """Wait for a run, then gather whatever else arrives within the flush window"""
+    batch = []
+    deadline = None
+    while len(batch) < GAME_RUN_BATCH_SIZE:
+        try:
+            item = _game_run_queue.get(timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+        except queue.Empty:
+            break
+        if item is None:
+            # Shutdown marker - take everything still queued into this last batch
+            while True:
+                try:
+                    batch.append(_game_run_queue.get_nowait())
+                except queue.Empty:
+                    return batch, True
+        batch.append(item)
+        if deadline is None:
+            deadline = time.monotonic() + GAME_RUN_FLUSH_SECONDS
+    return batch, False
+
+def _insert_game_runs(supabase: Client, batch, requeue=True):
+    """Insert a batch of queued runs, returning the (attempts, run) items that failed"""
+    if not batch:
+        return []
+    failed = []
     try:
-        # Normalize email to lowercase to ensure consistency
-        normalized_email = email.strip().lower()
-        supabase.table('game_runs').insert({
-            'user_name': user_name,
-            'email': normalized_email,
-            'predictions': predictions,
-            'random_numbers': random_numbers,
-            'score': score,
-            'game_type': game_type
-        }).execute()
-        return True
+        supabase.table('game_runs').insert([run for _, run in batch], returning='minimal').execute()
+        saved = batch
+    except PostgrestAPIError as e:
+        # The database rejected the batch - retry row by row so one bad run can't sink the rest
+        logger.warning("Saving %d game runs failed (%s), retrying one at a time", len(batch), e)
+        saved = []
+        for item in batch:
+            try:
+                supabase.table('game_runs').insert(item[1], returning='minimal').execute()
+                saved.append(item)
+            except Exception as row_error:
+                logger.warning("Saving a game run for %s failed: %s", item[1]['email'], row_error)
+                failed.append(item)
     except Exception as e:
-        st.error(f"Error saving game run: {e}")
-        return False
+        # Network trouble - none of the batch was saved
+        logger.warning("Saving %d game runs failed: %s", len(batch), e)
+        saved, failed = [], batch
+    
+    for attempts, run in failed:
+        if requeue and attempts + 1 < GAME_RUN_MAX_ATTEMPTS:
+            _game_run_queue.put((attempts + 1, run))
+        else:
+            logger.error("Dropping game run after %d attempts: %s", attempts + 1, run)
+    
+    # Drop the players' cached dashboards (same call as show_user_analytics)
+    # so they include the games just saved
+    for email in {run['email'] for _, run in saved}:
+        get_user_analytics.clear(supabase, email)
+    
+    return failed
 
 def update_leaderboard(supabase: Client, name, email, score, game_type="1-99_range_10_numbers"):
     """Update or create leaderboard entry"""
+    # Normalize email to lowercase to ensure consistency
+    normalized_email = email.strip().lower()
     try:
-        # Normalize email to lowercase to ensure consistency
-        normalized_email = email.strip().lower()
-        existing = supabase.table('leaderboard').select('*').eq('email', normalized_email).eq('game_type', game_type).execute()
+        try:
+            # One atomic upsert server-side (see database_functions.sql)
+            previous_best = supabase.rpc('save_score', {
+                'p_name': name,
+                'p_email': normalized_email,
+                'p_score': score,
+                'p_game_type': game_type
+            }).execute().data
+        except Exception as e:
+            # Only a missing save_score() may fall back - after any other error the
+            # upsert may already be committed, and retrying would count the game twice
+            _raise_unless_missing(e)
+            return _update_leaderboard_by_select(supabase, name, normalized_email, score, game_type)
+    except Exception as e:
+        st.error(f"Error updating leaderboard: {e}")
+        return False, "Error updating leaderboard"
+    
+    if previous_best is None:
+        return True, "Added to leaderboard!"
+    if score > previous_best:
+        return True, "New high score!"
+    return False, f"Your best is still {previous_best}/10"
+
+def _update_leaderboard_by_select(supabase: Client, name, normalized_email, score, game_type="1-99_range_10_numbers"):
+    """Update or create leaderboard entry with a select followed by an update or insert"""
+    try:
+        existing = supabase.table('leaderboard').select('best_score, total_games_played').eq('email', normalized_email).eq('game_type', game_type).execute()
         
         if existing.data:
             current_best = existing.data[0]['best_score']
@@ -40,12 +207,12 @@ def update_leaderboard(supabase: Client, name, email, score, game_type="1-99_ran
                     'name': name,
                     'best_score': score,
                     'total_games_played': total_games
-                }).eq('email', normalized_email).eq('game_type', game_type).execute()
+                }, returning='minimal').eq('email', normalized_email).eq('game_type', game_type).execute()
                 return True, "New high score!"
             else:
                 supabase.table('leaderboard').update({
                     'total_games_played': total_games
-                }).eq('email', normalized_email).eq('game_type', game_type).execute()
+                }, returning='minimal').eq('email', normalized_email).eq('game_type', game_type).execute()
                 return False, f"Your best is still {current_best}/10"
         else:
             supabase.table('leaderboard').insert({
@@ -54,70 +221,131 @@ def update_leaderboard(supabase: Client, name, email, score, game_type="1-99_ran
                 'best_score': score,
                 'total_games_played': 1,
                 'game_type': game_type
-            }).execute()
+            }, returning='minimal').execute()
             return True, "Added to leaderboard!"
             
     except Exception as e:
         st.error(f"Error updating leaderboard: {e}")
         return False, "Error updating leaderboard"
 
-@st.cache_data(ttl=300)  # Cache for 5 minutes
-def get_global_analytics(_supabase: Client, game_type="1-99_range_10_numbers"):
-    """Get global analytics data"""
+@st.cache_data(ttl=300, show_spinner=False)  # Cache for 5 minutes
+def get_global_snapshot(_supabase: Client, game_type="1-99_range_10_numbers"):
+    """Get global statistics and number frequencies in one read"""
+    try:
+        try:
+            # Precomputed by the mv_global_analytics materialized view (see database_functions.sql)
+            rows = _supabase.table('mv_global_analytics').select('stats, frequencies').eq('game_type', game_type).execute().data
+        except Exception as e:
+            # Scan game_runs client-side only when the view doesn't exist - not when
+            # the read merely failed, which is when the database can least afford it
+            _raise_unless_missing(e)
+            pred_freq, rand_freq = _count_number_frequencies(_supabase, game_type)
+            return _compute_global_stats(_supabase, game_type), pred_freq, rand_freq
+    except Exception as e:
+        st.error(f"Error getting global analytics: {e}")
+        return None, {}, {}
+
+    if not rows or not rows[0]['stats']['total_games']:
+        return None, {}, {}
+
+    stats = rows[0]['stats']
+    stats['avg_score'] = float(stats['avg_score'])
+    # JSON object keys come back as strings
+    stats['score_distribution'] = {int(score): count for score, count in stats['score_distribution'].items()}
+
+    freqs = {'pred': {}, 'rand': {}}
+    for row in rows[0]['frequencies'] or []:
+        freqs[row['kind']][row['n']] = row['c']
+    return stats, freqs['pred'], freqs['rand']
+
+def _compute_global_stats(supabase: Client, game_type="1-99_range_10_numbers"):
+    """Compute global analytics statistics from raw game runs"""
     try:
-        # Get all game runs
-        runs = _supabase.table('game_runs').select('*').eq('game_type', game_type).execute()
+        # Only the score and email columns are needed for the stats
+        runs = supabase.table('game_runs').select('score, email').eq('game_type', game_type).execute()
         
         if not runs.data:
             return None
-        df = pd.DataFrame(runs.data)
+        scores = np.fromiter((run['score'] for run in runs.data), dtype=np.int8, count=len(runs.data))
+        values, counts = np.unique(scores, return_counts=True)
         
         # Calculate statistics
         stats = {
-            'total_games': len(df),
-            'avg_score': df['score'].mean(),
-            'best_score': df['score'].max(),
-            'total_players': df['email'].nunique(),
-            'score_distribution': df['score'].value_counts().sort_index().to_dict()
+            'total_games': int(scores.size),
+            'avg_score': float(scores.mean()),
+            'best_score': int(scores.max()),
+            'total_players': len({run['email'] for run in runs.data}),
+            'score_distribution': dict(zip(values.tolist(), counts.tolist()))
         }
         
-        return df, stats
+        return stats
         
     except Exception as e:
         st.error(f"Error getting global analytics: {e}")
         return None
 
-@st.cache_data(ttl=300)
-def get_number_frequencies(_supabase: Client, game_type="1-99_range_10_numbers"):
-    """Get prediction and random number frequencies"""
+def _count_number_frequencies(supabase: Client, game_type="1-99_range_10_numbers"):
+    """Count prediction and random number frequencies from raw game runs"""
     try:
-        # Get all game runs and process client-side (simpler and more reliable)
-        runs = _supabase.table('game_runs').select('predictions, random_numbers').eq('game_type', game_type).execute()
-        
-        pred_freq = {}
-        rand_freq = {}
-        
-        for run in runs.data:
-            # Process predictions
-            for num in run['predictions']:
-                pred_freq[num] = pred_freq.get(num, 0) + 1
-            # Process random numbers
-            for num in run['random_numbers']:
-                rand_freq[num] = rand_freq.get(num, 0) + 1
-                
+        runs = supabase.table('game_runs').select('predictions, random_numbers').eq('game_type', game_type).execute()
+
+        # Flatten every run into one int array and count in a single C pass
+        # (walking runs.data dominates; large histories are counted by mv_global_analytics instead)
+        preds = np.fromiter(chain.from_iterable(run['predictions'] for run in runs.data), dtype=np.int16)
+        rands = np.fromiter(chain.from_iterable(run['random_numbers'] for run in runs.data), dtype=np.int16)
+        pred_counts = np.bincount(preds, minlength=100)
+        rand_counts = np.bincount(rands, minlength=100)
+
+        pred_freq = {int(num): int(pred_counts[num]) for num in np.flatnonzero(pred_counts)}
+        rand_freq = {int(num): int(rand_counts[num]) for num in np.flatnonzero(rand_counts)}
         return pred_freq, rand_freq
         
     except Exception as e:
         st.error(f"Error getting number frequencies: {e}")
         return {}, {}
 
-@st.cache_data(ttl=300)
+@st.cache_data(ttl=300, show_spinner=False)
 def get_user_analytics(_supabase: Client, email, game_type="1-99_range_10_numbers"):
     """Get user-specific analytics"""
+    # Normalize email to ensure consistent lookups
+    normalized_email = email.strip().lower()
+    try:
+        try:
+            # Aggregate server-side (see database_functions.sql)
+            user_stats = _supabase.rpc('user_stats', {'p_email': normalized_email, 'gt': game_type}).execute().data
+        except Exception as e:
+            # Re-scanning every run of the player is only worth it when user_stats() doesn't exist
+            _raise_unless_missing(e)
+            return _compute_user_analytics(_supabase, normalized_email, game_type)
+        
+        if not user_stats['total_games']:
+            return None
+        
+        # Only the latest runs are needed for the trend and history table - they come
+        # with the stats, unless the installed user_stats() predates recent_runs
+        recent_runs = user_stats.pop('recent_runs', None)
+        if recent_runs is None:
+            recent_runs = _supabase.table('game_runs').select('created_at, score, predictions, random_numbers').eq('email', normalized_email).eq('game_type', game_type).order('created_at', desc=True).limit(10).execute().data
+        df = pd.DataFrame(recent_runs)
+        df['created_at'] = pd.to_datetime(df['created_at'], utc=True)
+        
+        user_stats['avg_score'] = float(user_stats['avg_score'])
+        user_stats['first_game'] = pd.Timestamp(user_stats['first_game'])
+        user_stats['latest_score'] = int(df['score'].iloc[0])
+        # Rows are newest first; plot oldest to newest
+        user_stats['score_trend'] = df['score'].to_numpy()[::-1].tolist()
+        user_stats['favorite_numbers'] = [tuple(pair) for pair in user_stats['favorite_numbers'] or []]
+        
+        return _history_table(df), user_stats
+        
+    except Exception as e:
+        st.error(f"Error getting user analytics: {e}")
+        return None
+
+def _compute_user_analytics(supabase: Client, normalized_email, game_type="1-99_range_10_numbers"):
+    """Compute user-specific analytics from all of the user's raw game runs"""
     try:
-        # Normalize email to ensure consistent lookups
-        normalized_email = email.strip().lower()
-        runs = _supabase.table('game_runs').select('*').eq('email', normalized_email).eq('game_type', game_type).order('created_at', desc=True).execute()
+        runs = supabase.table('game_runs').select('created_at, score, predictions, random_numbers').eq('email', normalized_email).eq('game_type', game_type).order('created_at', desc=True).execute()
         
         if not runs.data:
             return None
@@ -135,34 +363,53 @@ def get_user_analytics(_supabase: Client, email, game_type="1-99_range_10_number
             'avg_score': df['score'].mean(),
             'latest_score': df['score'].iloc[0],
             'first_game': df['created_at'].min(),
-            'games_last_week': len(df[df['created_at'] > week_ago]),
-            'score_trend': df['score'].tolist()[-10:] if len(df) >= 10 else df['score'].tolist()
+            'games_last_week': int((df['created_at'] > week_ago).sum()),
+            # Rows are newest first; plot the latest ten oldest to newest
+            'score_trend': df['score'].to_numpy()[:10][::-1].tolist()
         }
         
         # User's most predicted numbers
-        user_predictions = {}
-        for _, run in df.iterrows():
-            for num in run['predictions']:
-                user_predictions[num] = user_predictions.get(num, 0) + 1
-                
-        user_stats['favorite_numbers'] = sorted(user_predictions.items(), key=lambda x: x[1], reverse=True)[:10]
+        all_predictions = np.concatenate([np.asarray(p, dtype=np.int16) for p in df['predictions'].values])
+        counts = np.bincount(all_predictions, minlength=100)
+        top = np.argsort(-counts, kind='stable')[:10]
+        user_stats['favorite_numbers'] = [(int(num), int(counts[num])) for num in top if counts[num]]
         
-        return df, user_stats
+        return _history_table(df), user_stats
         
     except Exception as e:
         st.error(f"Error getting user analytics: {e}")
         return None
 
-def create_number_heatmap(frequencies, title):
-    """Create a heatmap for number frequencies (1-99)"""
+def _format_numbers(numbers):
+    """Join numbers into a comma-separated string for display"""
+    return ", ".join(map(str, numbers))
+
+def _history_table(df):
+    """Format the ten most recent runs for the game history table"""
+    history_df = df[['created_at', 'score', 'predictions', 'random_numbers']].head(10)
+    return history_df.assign(
+        created_at=history_df['created_at'].dt.strftime('%Y-%m-%d %H:%M'),
+        predictions=history_df['predictions'].map(_format_numbers),
+        random_numbers=history_df['random_numbers'].map(_format_numbers)
+    )
+
+def _freq_array(frequencies):
+    """Convert a {number: count} dict into a length-100 count array indexed by number"""
+    counts = np.zeros(100, dtype=np.int64)
+    if frequencies:
+        counts[list(frequencies)] = list(frequencies.values())
+    return counts
+
+@st.cache_data(ttl=300, show_spinner=False)
+def create_number_heatmap(freq_items, title):
+    """Create a heatmap for number frequencies (1-99) from hashable (number, count) pairs"""
     # Create 10x10 grid for numbers 1-99 (with 0 for 100)
-    grid = np.zeros((10, 10))
-    
-    for num, freq in frequencies.items():
-        if 1 <= num <= 99:
-            row = (num - 1) // 10
-            col = (num - 1) % 10
-            grid[row, col] = freq
+    flat = np.zeros(100)
+    valid = [(num, freq) for num, freq in freq_items if 1 <= num <= 99]
+    if valid:
+        nums, freqs = zip(*valid)
+        flat[np.array(nums) - 1] = freqs
+    grid = flat.reshape(10, 10)
     
     fig = go.Figure(data=go.Heatmap(
         z=grid,
@@ -172,6 +419,7 @@ def create_number_heatmap(frequencies, title):
     ))
     
     # Add number labels
+    label_threshold = grid.max() * 0.5
     annotations = []
     for i in range(10):
         for j in range(10):
@@ -182,7 +430,7 @@ def create_number_heatmap(frequencies, title):
                         x=j, y=i,
                         text=str(number),
                         showarrow=False,
-                        font=dict(color="white" if grid[i, j] > grid.max() * 0.5 else "black")
+                        font=dict(color="white" if grid[i, j] > label_threshold else "black")
                     )
                 )
     
@@ -196,17 +444,115 @@ def create_number_heatmap(frequencies, title):
     
     return fig
 
+@st.cache_data(ttl=300, show_spinner=False)
+def _compute_global_view(pred_freq_items, rand_freq_items, avg_score):
+    """Derive every figure shown on the global analytics page from hashable frequency pairs"""
+    pf = _freq_array(dict(pred_freq_items))
+    rf = _freq_array(dict(rand_freq_items))
+    total_pred = int(pf.sum())
+    total_rand = int(rf.sum())
+    
+    # Theoretical vs actual hit rate
+    theoretical_hit_rate = (10/99) * 100  # 10 predictions out of 99 possible
+    actual_hit_rate = (avg_score / 10) * 100
+    view = {
+        'hit_rate': actual_hit_rate,
+        'luck_factor': actual_hit_rate / theoretical_hit_rate
+    }
+    
+    if total_pred:
+        # Human bias analysis
+        view['most_predicted'] = int(pf.argmax())
+        view['most_predicted_count'] = int(pf.max())
+        view['least_predicted'] = np.flatnonzero(pf == pf[pf > 0].min()).tolist()
+        view['pred_ranges'] = [int(pf[_SMALL_MASK].sum()), int(pf[_MEDIUM_MASK].sum()), int(pf[_LARGE_MASK].sum())]
+        view['mult5_pct'] = (int(pf[_MULT5_MASK].sum()) / total_pred) * 100
+    
+    if total_rand:
+        # Random number analysis
+        view['most_drawn'] = int(rf.argmax())
+        view['most_drawn_count'] = int(rf.max())
+        view['least_drawn'] = np.flatnonzero(rf == rf[rf > 0].min()).tolist()
+        view['rand_ranges'] = [int(rf[_SMALL_MASK].sum()), int(rf[_MEDIUM_MASK].sum()), int(rf[_LARGE_MASK].sum())]
+        view['rand_std'] = float(np.std(rf[rf > 0]))
+    
+    if not (total_pred and total_rand):
+        return view
+    
+    # Numbers that were both predicted often AND drawn often - top 15 by overlap
+    overlap = np.minimum(pf, rf)
+    common = np.flatnonzero(overlap)
+    if common.size > 15:
+        common = common[np.argpartition(overlap[common], -15)[-15:]]
+    view['common_numbers'] = common.tolist()
+    view['common_predicted'] = pf[common].tolist()
+    view['common_drawn'] = rf[common].tolist()
+    view['common_overlap'] = overlap[common].tolist()
+    
+    # Prime, even/odd and special pattern percentages
+    pred_prime_pct = (int(pf[_PRIME_MASK].sum()) / total_pred) * 100
+    rand_prime_pct = (int(rf[_PRIME_MASK].sum()) / total_rand) * 100
+    expected_prime_pct = (len(_PRIMES) / 99) * 100  # 25 primes out of 99 numbers
+    pred_even_pct = (int(pf[_EVEN_MASK].sum()) / total_pred) * 100
+    rand_even_pct = (int(rf[_EVEN_MASK].sum()) / total_rand) * 100
+    pred_7s_pct = (int(pf[_LUCKY7_MASK].sum()) / total_pred) * 100
+    pred_13s_pct = (int(pf[_UNLUCKY13_MASK].sum()) / total_pred) * 100
+    expected_13s_pct = (int(_UNLUCKY13_MASK.sum()) / 99) * 100
+    pred_repeating_pct = (int(pf[_REPEAT_MASK].sum()) / total_pred) * 100
+    mult_10_pct = (int(pf[_MULT10_MASK].sum()) / total_pred) * 100
+    
+    # Pattern seekers index
+    pattern_score = 0
+    if pred_repeating_pct > 10: pattern_score += 1
+    if abs(pred_even_pct - 50) > 10: pattern_score += 1
+    if pred_7s_pct > 12: pattern_score += 1
+    
+    insights = []
+    # Check if avoiding primes hurts
+    if pred_prime_pct < expected_prime_pct - 5 and rand_prime_pct > expected_prime_pct - 2:
+        insights.append("❌ **Prime avoidance** reduces hit rate by ~3%")
+    # Check even/odd imbalance
+    if abs(pred_even_pct - 50) > 10:
+        insights.append("⚠️ **Even/odd bias** has no impact on success")
+    # Multiples of 10
+    if mult_10_pct > 12:
+        insights.append("📊 **Round number preference** is purely psychological")
+    
+    # Calculate a "Randomness Score" for the community
+    randomness_score = 100
+    if abs(pred_prime_pct - expected_prime_pct) > 5: randomness_score -= 15
+    if abs(pred_even_pct - 50) > 5: randomness_score -= 10
+    if pred_repeating_pct > 10: randomness_score -= 10
+    
+    view.update({
+        'pred_prime_pct': pred_prime_pct,
+        'rand_prime_pct': rand_prime_pct,
+        'expected_prime_pct': expected_prime_pct,
+        'pred_even_pct': pred_even_pct,
+        'rand_even_pct': rand_even_pct,
+        'pred_7s_pct': pred_7s_pct,
+        'pred_13s_pct': pred_13s_pct,
+        'expected_13s_pct': expected_13s_pct,
+        'pred_repeating_pct': pred_repeating_pct,
+        'pattern_score': pattern_score,
+        'insights': insights,
+        'randomness_score': randomness_score
+    })
+    return view
+
 def show_global_analytics(supabase: Client):
     """Display global analytics page"""
     st.header("📊 Global Analytics")
     st.markdown("*Exploring the fascinating world of randomness vs human prediction patterns*")
     
-    result = get_global_analytics(supabase)
-    if not result:
+    stats, pred_freq, rand_freq = get_global_snapshot(supabase)
+    if not stats:
         st.info("🎯 Play some games to see global analytics!")
         return
     
-    df, stats = result
+    pred_items = tuple(sorted(pred_freq.items()))
+    rand_items = tuple(sorted(rand_freq.items()))
+    view = _compute_global_view(pred_items, rand_items, stats['avg_score'])
     
     # Key insights at the top
     col1, col2, col3 = st.columns(3)
@@ -215,25 +561,24 @@ def show_global_analytics(supabase: Client):
     with col2:
         st.metric("Community Average", f"{stats['avg_score']:.1f}/10")
     with col3:
-        best_possible = 10
-        hit_rate = (stats['avg_score'] / best_possible) * 100
-        st.metric("Hit Rate", f"{hit_rate:.1f}%")
+        st.metric("Hit Rate", f"{view['hit_rate']:.1f}%")
     
     # Number frequency analysis - THE MAIN EVENT
     st.subheader("🔥 The Psychology of Numbers")
     st.markdown("**Do humans have number biases? Is randomness truly random?**")
     
-    pred_freq, rand_freq = get_number_frequencies(supabase)
-    
-    if pred_freq and rand_freq:
+    games_needed = MIN_GAMES_FOR_HEATMAPS - stats['total_games']
+    if games_needed > 0:
+        st.info(f"🔒 Need {games_needed} more games to unlock the number heatmaps")
+    elif pred_freq and rand_freq:
         col1, col2 = st.columns(2)
         with col1:
-            fig = create_number_heatmap(pred_freq, "🧠 Human Predictions")
+            fig = create_number_heatmap(pred_items, "🧠 Human Predictions")
             st.plotly_chart(fig, use_container_width=True)
             st.markdown("*What numbers do humans favor?*")
         
         with col2:
-            fig = create_number_heatmap(rand_freq, "🎲 True Random Numbers")
+            fig = create_number_heatmap(rand_items, "🎲 True Random Numbers")
             st.plotly_chart(fig, use_container_width=True)
             st.markdown("*Random.org's unbiased distribution*")
     
@@ -243,56 +588,26 @@ def show_global_analytics(supabase: Client):
     col1, col2 = st.columns(2)
     
     with col1:
-        # Human bias analysis
         if pred_freq:
-            pred_values = list(pred_freq.values())
-            pred_keys = list(pred_freq.keys())
-            
-            # Find most/least predicted
-            most_predicted = max(pred_keys, key=lambda x: pred_freq[x])
-            least_predicted_keys = [k for k, v in pred_freq.items() if v == min(pred_values)]
-            
             st.markdown("#### 🧠 Human Patterns")
-            st.metric("Most Predicted Number", most_predicted, f"{pred_freq[most_predicted]} times")
-            st.write(f"**Least Predicted:** {', '.join(map(str, least_predicted_keys[:5]))}")
-            
-            # Range analysis
-            small_nums = sum(v for k, v in pred_freq.items() if k <= 33)
-            mid_nums = sum(v for k, v in pred_freq.items() if 34 <= k <= 66)
-            big_nums = sum(v for k, v in pred_freq.items() if k >= 67)
-            total_predictions = sum(pred_freq.values())
+            st.metric("Most Predicted Number", view['most_predicted'], f"{view['most_predicted_count']} times")
+            st.write(f"**Least Predicted:** {_format_numbers(view['least_predicted'][:5])}")
             
             fig = px.pie(
-                values=[small_nums, mid_nums, big_nums],
+                values=view['pred_ranges'],
                 names=['Small (1-33)', 'Medium (34-66)', 'Large (67-99)'],
                 title="Human Range Preferences"
             )
             st.plotly_chart(fig, use_container_width=True)
     
     with col2:
-        # Random number analysis  
         if rand_freq:
-            rand_values = list(rand_freq.values())
-            rand_keys = list(rand_freq.keys())
-            
-            # Statistical tests for randomness
-            most_drawn = max(rand_keys, key=lambda x: rand_freq[x])
-            least_drawn_keys = [k for k, v in rand_freq.items() if v == min(rand_values)]
-            
             st.markdown("#### 🎲 Randomness Quality")
-            st.metric("Most Drawn Number", most_drawn, f"{rand_freq[most_drawn]} times")
-            st.write(f"**Least Drawn:** {', '.join(map(str, least_drawn_keys[:5]))}")
-            
-            # Check if random is truly uniform
-            expected_freq = sum(rand_values) / len(rand_values)
-            variance = sum((v - expected_freq) ** 2 for v in rand_values) / len(rand_values)
-            
-            small_rand = sum(v for k, v in rand_freq.items() if k <= 33)
-            mid_rand = sum(v for k, v in rand_freq.items() if 34 <= k <= 66)
-            big_rand = sum(v for k, v in rand_freq.items() if k >= 67)
+            st.metric("Most Drawn Number", view['most_drawn'], f"{view['most_drawn_count']} times")
+            st.write(f"**Least Drawn:** {_format_numbers(view['least_drawn'][:5])}")
             
             fig = px.pie(
-                values=[small_rand, mid_rand, big_rand],
+                values=view['rand_ranges'],
                 names=['Small (1-33)', 'Medium (34-66)', 'Large (67-99)'],
                 title="True Random Distribution"
             )
@@ -301,41 +616,25 @@ def show_global_analytics(supabase: Client):
     # Prediction accuracy insights
     st.subheader("🎯 The Reality of Prediction")
     
-    # Create a comparison of predicted vs actual matches
-    if pred_freq and rand_freq:
-        # Numbers that were both predicted often AND drawn often
-        common_numbers = []
-        for num in range(1, 100):
-            pred_count = pred_freq.get(num, 0)
-            rand_count = rand_freq.get(num, 0)
-            if pred_count > 0 and rand_count > 0:
-                common_numbers.append({
-                    'number': num,
-                    'predicted': pred_count,
-                    'drawn': rand_count,
-                    'overlap': min(pred_count, rand_count)
-                })
-        
-        if common_numbers:
-            common_df = pd.DataFrame(common_numbers)
-            common_df = common_df.nlargest(15, 'overlap')
-            
-            fig = px.scatter(
-                common_df, 
-                x='predicted', 
-                y='drawn',
-                size='overlap',
-                hover_name='number',
-                title="Predicted vs Drawn: The Sweet Spot Numbers",
-                labels={'predicted': 'Times Predicted by Humans', 'drawn': 'Times Drawn Randomly'}
-            )
-            fig.add_shape(
-                type="line", line=dict(dash="dash"),
-                x0=0, x1=common_df['predicted'].max(),
-                y0=0, y1=common_df['predicted'].max()
-            )
-            st.plotly_chart(fig, use_container_width=True)
-            st.markdown("*Numbers on the diagonal line show perfect prediction-reality alignment*")
+    if games_needed > 0:
+        st.info(f"🔒 Need {games_needed} more games to unlock the sweet spot chart")
+    elif view.get('common_numbers'):
+        fig = px.scatter(
+            x=view['common_predicted'],
+            y=view['common_drawn'],
+            size=view['common_overlap'],
+            hover_name=view['common_numbers'],
+            title="Predicted vs Drawn: The Sweet Spot Numbers",
+            labels={'x': 'Times Predicted by Humans', 'y': 'Times Drawn Randomly'}
+        )
+        max_predicted = max(view['common_predicted'])
+        fig.add_shape(
+            type="line", line=dict(dash="dash"),
+            x0=0, x1=max_predicted,
+            y0=0, y1=max_predicted
+        )
+        st.plotly_chart(fig, use_container_width=True)
+        st.markdown("*Numbers on the diagonal line show perfect prediction-reality alignment*")
     
     # Fun facts
     st.subheader("🤔 Fascinating Insights")
@@ -344,139 +643,89 @@ def show_global_analytics(supabase: Client):
     
     with col1:
         if pred_freq:
-            # Check for patterns (multiples, sequences)
-            multiples_of_5 = sum(v for k, v in pred_freq.items() if k % 5 == 0)
-            total_pred = sum(pred_freq.values())
-            mult5_pct = (multiples_of_5 / total_pred) * 100
-            st.metric("Multiples of 5", f"{mult5_pct:.1f}%", "of predictions")
+            st.metric("Multiples of 5", f"{view['mult5_pct']:.1f}%", "of predictions")
     
     with col2:
         if rand_freq:
-            # Random distribution uniformity
-            rand_std = np.std(list(rand_freq.values()))
-            st.metric("Random Uniformity", f"{rand_std:.1f}", "std deviation")
+            st.metric("Random Uniformity", f"{view['rand_std']:.1f}", "std deviation")
     
     with col3:
-        # Theoretical vs actual hit rate
-        theoretical_hit_rate = (10/99) * 100  # 10 predictions out of 99 possible
-        actual_hit_rate = (stats['avg_score'] / 10) * 100
-        st.metric("Luck Factor", f"{actual_hit_rate/theoretical_hit_rate:.1f}x", "vs random chance")
+        st.metric("Luck Factor", f"{view['luck_factor']:.1f}x", "vs random chance")
     
     # Pattern Laboratory - The new exciting section!
     st.subheader("🧪 Pattern Laboratory")
     st.markdown("*Uncovering hidden biases and their impact on performance*")
     
-    if pred_freq and rand_freq:
-        # Define prime numbers between 1-99
-        primes = {2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41, 43, 47, 53, 59, 61, 67, 71, 73, 79, 83, 89, 97}
+    games_needed = MIN_GAMES_FOR_PATTERNS - stats['total_games']
+    if games_needed > 0:
+        st.info(f"🔒 Need {games_needed} more games to unlock the Pattern Laboratory")
+        return
+    if not (pred_freq and rand_freq):
+        return
+    
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        st.markdown("#### 🔢 Prime Number Bias")
+        pred_prime_pct = view['pred_prime_pct']
+        rand_prime_pct = view['rand_prime_pct']
+        expected_prime_pct = view['expected_prime_pct']
         
-        # Calculate prime vs composite statistics
-        pred_primes = sum(v for k, v in pred_freq.items() if k in primes)
-        pred_composites = sum(v for k, v in pred_freq.items() if k not in primes and k > 1)
-        rand_primes = sum(v for k, v in rand_freq.items() if k in primes)
-        rand_composites = sum(v for k, v in rand_freq.items() if k not in primes and k > 1)
+        st.metric("Human Prime %", f"{pred_prime_pct:.1f}%", 
+                 f"{pred_prime_pct - expected_prime_pct:+.1f}% vs expected")
+        st.metric("Random Prime %", f"{rand_prime_pct:.1f}%",
+                 f"{rand_prime_pct - expected_prime_pct:+.1f}% vs expected")
         
-        # Calculate even/odd statistics
-        pred_even = sum(v for k, v in pred_freq.items() if k % 2 == 0)
-        pred_odd = sum(v for k, v in pred_freq.items() if k % 2 == 1)
-        rand_even = sum(v for k, v in rand_freq.items() if k % 2 == 0)
-        rand_odd = sum(v for k, v in rand_freq.items() if k % 2 == 1)
+        # Visualization
+        prime_data = pd.DataFrame({
+            'Type': ['Human Predictions', 'True Random', 'Mathematical Expected'],
+            'Prime %': [pred_prime_pct, rand_prime_pct, expected_prime_pct]
+        })
+        fig = px.bar(prime_data, x='Type', y='Prime %', 
+                    title="Prime Number Distribution",
+                    color='Prime %', color_continuous_scale='RdYlGn')
+        fig.update_layout(height=300)
+        st.plotly_chart(fig, use_container_width=True)
         
-        col1, col2, col3 = st.columns(3)
+        if pred_prime_pct < expected_prime_pct - 5:
+            st.warning("⚠️ Humans avoid primes!")
+        elif pred_prime_pct > expected_prime_pct + 5:
+            st.info("📈 Humans favor primes!")
+    
+    with col2:
+        st.markdown("#### ⚖️ Even/Odd Balance")
+        pred_even_pct = view['pred_even_pct']
+        rand_even_pct = view['rand_even_pct']
         
-        with col1:
-            st.markdown("#### 🔢 Prime Number Bias")
-            total_pred = sum(pred_freq.values())
-            total_rand = sum(rand_freq.values())
-            
-            pred_prime_pct = (pred_primes / total_pred) * 100 if total_pred > 0 else 0
-            rand_prime_pct = (rand_primes / total_rand) * 100 if total_rand > 0 else 0
-            expected_prime_pct = (len(primes) / 99) * 100  # 25 primes out of 99 numbers
-            
-            st.metric("Human Prime %", f"{pred_prime_pct:.1f}%", 
-                     f"{pred_prime_pct - expected_prime_pct:+.1f}% vs expected")
-            st.metric("Random Prime %", f"{rand_prime_pct:.1f}%",
-                     f"{rand_prime_pct - expected_prime_pct:+.1f}% vs expected")
-            
-            # Visualization
-            prime_data = pd.DataFrame({
-                'Type': ['Human Predictions', 'True Random', 'Mathematical Expected'],
-                'Prime %': [pred_prime_pct, rand_prime_pct, expected_prime_pct]
-            })
-            fig = px.bar(prime_data, x='Type', y='Prime %', 
-                        title="Prime Number Distribution",
-                        color='Prime %', color_continuous_scale='RdYlGn')
-            fig.update_layout(height=300)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            if pred_prime_pct < expected_prime_pct - 5:
-                st.warning("⚠️ Humans avoid primes!")
-            elif pred_prime_pct > expected_prime_pct + 5:
-                st.info("📈 Humans favor primes!")
+        st.metric("Human Even %", f"{pred_even_pct:.1f}%",
+                 f"{pred_even_pct - 50:+.1f}% vs balanced")
+        st.metric("Random Even %", f"{rand_even_pct:.1f}%",
+                 f"{rand_even_pct - 50:+.1f}% vs balanced")
         
-        with col2:
-            st.markdown("#### ⚖️ Even/Odd Balance")
-            
-            pred_even_pct = (pred_even / total_pred) * 100 if total_pred > 0 else 0
-            rand_even_pct = (rand_even / total_rand) * 100 if total_rand > 0 else 0
-            
-            st.metric("Human Even %", f"{pred_even_pct:.1f}%",
-                     f"{pred_even_pct - 50:+.1f}% vs balanced")
-            st.metric("Random Even %", f"{rand_even_pct:.1f}%",
-                     f"{rand_even_pct - 50:+.1f}% vs balanced")
-            
-            # Create a double-sided bar chart
-            even_odd_data = pd.DataFrame({
-                'Category': ['Human', 'Random'],
-                'Even': [pred_even_pct, rand_even_pct],
-                'Odd': [100 - pred_even_pct, 100 - rand_even_pct]
-            })
-            
-            fig = go.Figure()
-            fig.add_trace(go.Bar(name='Even', x=even_odd_data['Category'], y=even_odd_data['Even'],
-                                marker_color='lightblue'))
-            fig.add_trace(go.Bar(name='Odd', x=even_odd_data['Category'], y=even_odd_data['Odd'],
-                                marker_color='lightcoral'))
-            fig.update_layout(barmode='stack', title="Even vs Odd Distribution", height=300)
-            st.plotly_chart(fig, use_container_width=True)
-            
-            if abs(pred_even_pct - 50) > 5:
-                bias_type = "even" if pred_even_pct > 50 else "odd"
-                st.warning(f"🎯 Strong {bias_type} number bias detected!")
+        # Create a double-sided bar chart
+        fig = go.Figure()
+        fig.add_trace(go.Bar(name='Even', x=['Human', 'Random'], y=[pred_even_pct, rand_even_pct],
+                            marker_color='lightblue'))
+        fig.add_trace(go.Bar(name='Odd', x=['Human', 'Random'], y=[100 - pred_even_pct, 100 - rand_even_pct],
+                            marker_color='lightcoral'))
+        fig.update_layout(barmode='stack', title="Even vs Odd Distribution", height=300)
+        st.plotly_chart(fig, use_container_width=True)
         
-        with col3:
-            st.markdown("#### 🎰 Special Patterns")
-            
-            # Lucky 7s (7, 17, 27, 37, 47, 57, 67, 77, 87, 97)
-            lucky_7s = {7, 17, 27, 37, 47, 57, 67, 77, 87, 97}
-            pred_7s = sum(v for k, v in pred_freq.items() if k in lucky_7s)
-            pred_7s_pct = (pred_7s / total_pred) * 100 if total_pred > 0 else 0
-            
-            # Unlucky 13s (13, 31)  
-            unlucky_13s = {13, 31}
-            pred_13s = sum(v for k, v in pred_freq.items() if k in unlucky_13s)
-            pred_13s_pct = (pred_13s / total_pred) * 100 if total_pred > 0 else 0
-            expected_13s_pct = (len(unlucky_13s) / 99) * 100
-            
-            # Repeating digits (11, 22, 33, 44, 55, 66, 77, 88, 99)
-            repeating = {11, 22, 33, 44, 55, 66, 77, 88, 99}
-            pred_repeating = sum(v for k, v in pred_freq.items() if k in repeating)
-            pred_repeating_pct = (pred_repeating / total_pred) * 100 if total_pred > 0 else 0
-            
-            st.metric("Lucky 7s", f"{pred_7s_pct:.1f}%", "of predictions")
-            st.metric("Number 13 Avoidance", 
-                     f"{expected_13s_pct - pred_13s_pct:.1f}%",
-                     "less than expected" if pred_13s_pct < expected_13s_pct else "not avoided")
-            st.metric("Repeating Digits", f"{pred_repeating_pct:.1f}%", "11, 22, 33...")
-            
-            # Pattern seekers index
-            pattern_score = 0
-            if pred_repeating_pct > 10: pattern_score += 1
-            if abs(pred_even_pct - 50) > 10: pattern_score += 1
-            if pred_7s_pct > 12: pattern_score += 1
-            
-            pattern_labels = ["Random Guesser", "Mild Patterns", "Pattern Seeker", "Heavy Bias"]
-            st.info(f"🧠 Community Pattern Level: **{pattern_labels[min(pattern_score, 3)]}**")
+        if abs(pred_even_pct - 50) > 5:
+            bias_type = "even" if pred_even_pct > 50 else "odd"
+            st.warning(f"🎯 Strong {bias_type} number bias detected!")
+    
+    with col3:
+        st.markdown("#### 🎰 Special Patterns")
+        
+        st.metric("Lucky 7s", f"{view['pred_7s_pct']:.1f}%", "of predictions")
+        st.metric("Number 13 Avoidance", 
+                 f"{view['expected_13s_pct'] - view['pred_13s_pct']:.1f}%",
+                 "less than expected" if view['pred_13s_pct'] < view['expected_13s_pct'] else "not avoided")
+        st.metric("Repeating Digits", f"{view['pred_repeating_pct']:.1f}%", "11, 22, 33...")
+        
+        pattern_labels = ["Random Guesser", "Mild Patterns", "Pattern Seeker", "Heavy Bias"]
+        st.info(f"🧠 Community Pattern Level: **{pattern_labels[min(view['pattern_score'], 3)]}**")
     
     # Bias Performance Analysis
     st.subheader("📈 Bias Performance Impact")
@@ -487,28 +736,11 @@ def show_global_analytics(supabase: Client):
     
     with col1:
         st.markdown("#### 🎯 Pattern Insights")
-        insights = []
-        
-        if pred_freq and rand_freq:
-            # Check if avoiding primes hurts
-            if pred_prime_pct < expected_prime_pct - 5 and rand_prime_pct > expected_prime_pct - 2:
-                insights.append("❌ **Prime avoidance** reduces hit rate by ~3%")
-            
-            # Check even/odd imbalance  
-            if abs(pred_even_pct - 50) > 10:
-                insights.append("⚠️ **Even/odd bias** has no impact on success")
-            
-            # Multiples of 10
-            mult_10 = sum(v for k, v in pred_freq.items() if k % 10 == 0)
-            mult_10_pct = (mult_10 / total_pred) * 100 if total_pred > 0 else 0
-            if mult_10_pct > 12:
-                insights.append("📊 **Round number preference** is purely psychological")
-            
-            if insights:
-                for insight in insights:
-                    st.write(insight)
-            else:
-                st.success("✅ Community shows balanced prediction patterns!")
+        if view['insights']:
+            for insight in view['insights']:
+                st.write(insight)
+        else:
+            st.success("✅ Community shows balanced prediction patterns!")
     
     with col2:
         st.markdown("#### 💡 Recommendations")
@@ -520,13 +752,7 @@ def show_global_analytics(supabase: Client):
         - Patterns don't improve chances
         """)
         
-        # Calculate a "Randomness Score" for the community
-        randomness_score = 100
-        if abs(pred_prime_pct - expected_prime_pct) > 5: randomness_score -= 15
-        if abs(pred_even_pct - 50) > 5: randomness_score -= 10
-        if pred_repeating_pct > 10: randomness_score -= 10
-        
-        st.metric("Community Randomness Score", f"{randomness_score}/100",
+        st.metric("Community Randomness Score", f"{view['randomness_score']}/100",
                  "Higher = Less Biased = Better!")
 
 def show_user_analytics(supabase: Client, email):
@@ -538,7 +764,7 @@ def show_user_analytics(supabase: Client, email):
         st.info("🎯 Play some games to see your personal analytics!")
         return
     
-    df, stats = result
+    history_df, stats = result
     
     # Personal metrics
     col1, col2, col3, col4 = st.columns(4)
@@ -568,11 +794,6 @@ def show_user_analytics(supabase: Client, email):
     
     # Game history
     st.subheader("📋 Recent Game History")
-    history_df = df[['created_at', 'score', 'predictions', 'random_numbers']].head(10)
-    history_df['created_at'] = history_df['created_at'].dt.strftime('%Y-%m-%d %H:%M')
-    history_df['predictions'] = history_df['predictions'].astype(str)
-    history_df['random_numbers'] = history_df['random_numbers'].astype(str)
-    
     st.dataframe(
         history_df,
         column_config={
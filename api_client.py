@@ -1,16 +1,87 @@
 import requests
+from requests.adapters import HTTPAdapter
+import logging
 import os
+import queue
+import threading
+import time
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# Draws kept ready by the prefetch thread - small, since every one costs API quota
+PREFETCH_DRAWS = 4
+# The buffer is topped up once fewer draws than this are left
+PREFETCH_LOW_WATER = 2
+# Failed prefetches back off exponentially up to this
+PREFETCH_MAX_BACKOFF_SECONDS = 300
+
+class RandomOrgAPIError(Exception):
+    """Random.org rejected the request (bad key, quota used up, ...) - retrying won't help"""
+
+def _new_session():
+    """Keep-alive session, so draws don't each pay for a new TCP+TLS handshake"""
+    session = requests.Session()
+    session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+    return session
+
 class RandomOrgClient:
     def __init__(self):
         self.api_key = os.getenv('RANDOM_API_KEY')
         self.base_url = "https://api.random.org/json-rpc/4/invoke"
+        self.session = _new_session()
+        # Game draws fetched ahead of time (see start_prefetch)
+        self._draws = queue.Queue(maxsize=PREFETCH_DRAWS)
+        # Set by get_game_numbers when the buffer runs low
+        self._refill = threading.Event()
+    
+    def start_prefetch(self):
+        """Keep a few game draws ready in a background thread, starting once games are played"""
+        threading.Thread(target=self._prefetch_draws, daemon=True, name="random-org-prefetch").start()
+    
+    def _prefetch_draws(self):
+        """Top the draw buffer up each time it runs low"""
+        # requests.Session isn't thread-safe, so the worker has its own
+        session = _new_session()
+        failures = 0
+        while True:
+            self._refill.wait()
+            self._refill.clear()
+            while not self._draws.full():
+                try:
+                    draw = self._request_numbers(session, 10, 1, 99)
+                except RandomOrgAPIError as e:
+                    # Games keep asking directly and show the error to the player
+                    logger.error("Stopping Random.org prefetch: %s", e)
+                    return
+                except Exception as e:
+                    failures += 1
+                    delay = min(2 ** failures, PREFETCH_MAX_BACKOFF_SECONDS)
+                    logger.warning("Random.org prefetch failed, retrying in %ds: %s", delay, e)
+                    time.sleep(delay)
+                    continue
+                failures = 0
+                self._draws.put(draw)
+    
+    def get_game_numbers(self):
+        """Get 10 unique random numbers (1-99) for a game, prefetched if one is ready"""
+        try:
+            return self._draws.get_nowait()
+        except queue.Empty:
+            # Buffer empty (no game played yet, still filling or failing) - ask directly
+            return self.generate_random_numbers(10, 1, 99)
+        finally:
+            if self._draws.qsize() < PREFETCH_LOW_WATER:
+                self._refill.set()
     
     def generate_random_numbers(self, count=10, min_val=1, max_val=99):
         """Generate random numbers using Random.org API"""
+        return self._request_numbers(self.session, count, min_val, max_val)
+    
+    def _request_numbers(self, session, count, min_val, max_val):
+        """Call generateIntegers on the given session"""
         payload = {
             "jsonrpc": "2.0",
             "method": "generateIntegers",
@@ -25,19 +96,20 @@ class RandomOrgClient:
         }
         
         try:
-            response = requests.post(self.base_url, json=payload)
+            response = session.post(self.base_url, json=payload, timeout=5)
             response.raise_for_status()
             data = response.json()
-            
-            if "result" in data:
-                return data["result"]["random"]["data"]
-            else:
-                raise Exception(f"API Error: {data.get('error', 'Unknown error')}")
-                
+        except requests.exceptions.HTTPError as e:
+            if e.response.status_code < 500:
+                raise RandomOrgAPIError(f"Random.org API error: {str(e)}")
+            raise Exception(f"Network error: {str(e)}")
         except requests.exceptions.RequestException as e:
             raise Exception(f"Network error: {str(e)}")
-        except Exception as e:
-            raise Exception(f"Random.org API error: {str(e)}")
+        
+        if "result" in data:
+            return data["result"]["random"]["data"]
+        # JSON-RPC errors, including an exhausted quota, come back with HTTP 200
+        raise RandomOrgAPIError(f"Random.org API error: {data.get('error', 'Unknown error')}")
 
 # Test function
 if __name__ == "__main__":
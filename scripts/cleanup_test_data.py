@@ -1,18 +1,14 @@
 #!/usr/bin/env python3
 
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase_client import get_supabase, for_each_table
 
-load_dotenv()
+TABLES = ('game_runs', 'leaderboard')
 
 def cleanup_test_data():
     """Remove all test data"""
     print("🧹 Cleaning up test data...")
     
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SECRET_KEY") 
-    supabase: Client = create_client(url, key)
+    supabase = get_supabase()
     
     test_emails = [
         "alice@demo.com", "bob@demo.com", "charlie@demo.com", 
@@ -20,16 +16,13 @@ def cleanup_test_data():
     ]
     
     try:
-        # Count existing test data
-        total_runs = 0
-        total_leaderboard = 0
-        
-        for email in test_emails:
-            runs = supabase.table('game_runs').select('id').eq('email', email).execute()
-            total_runs += len(runs.data)
-            
-            leaderboard = supabase.table('leaderboard').select('id').eq('email', email).execute()
-            total_leaderboard += len(leaderboard.data)
+        # Count existing test data (count only - no rows shipped back)
+        runs, leaderboard = for_each_table(
+            TABLES,
+            lambda table: supabase.table(table).select('id', count='exact', head=True).in_('email', test_emails).execute()
+        )
+        total_runs = runs.count or 0
+        total_leaderboard = leaderboard.count or 0
         
         print(f"Found {total_runs} test game runs and {total_leaderboard} leaderboard entries")
         
@@ -43,17 +36,15 @@ def cleanup_test_data():
             print("❌ Cleanup cancelled")
             return
         
-        # Remove from game_runs
-        for email in test_emails:
-            result = supabase.table('game_runs').delete().eq('email', email).execute()
-            if result.data:
-                print(f"  • Removed {len(result.data)} game runs for {email}")
-        
-        # Remove from leaderboard
-        for email in test_emails:
-            result = supabase.table('leaderboard').delete().eq('email', email).execute()
-            if result.data:
-                print(f"  • Removed leaderboard entry for {email}")
+        # Remove from game_runs and leaderboard
+        runs, leaderboard = for_each_table(
+            TABLES,
+            lambda table: supabase.table(table).delete(count='exact', returning='minimal').in_('email', test_emails).execute()
+        )
+        if runs.count:
+            print(f"  • Removed {runs.count} game runs")
+        if leaderboard.count:
+            print(f"  • Removed {leaderboard.count} leaderboard entries")
         
         print("✅ Test data cleaned up successfully!")
         print("🎯 Analytics will now show only real user data")
@@ -1,22 +1,41 @@
 #!/usr/bin/env python3
 
-import os
 import random
+from collections import defaultdict
+import numpy as np
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from itertools import chain
+from supabase_client import get_supabase, raise_unless_missing, for_each_table
 
-load_dotenv()
+# Rows per insert request - keeps payloads well under PostgREST's request limit
+BATCH_SIZE = 1000
+
+MULT5 = tuple(range(5, 100, 5))
+
+# Favorite numbers of the demo users that don't pick at random
+PREDICTION_POOLS = {
+    "alice@demo.com": range(1, 31),    # Alice likes small numbers
+    "bob@demo.com": range(50, 100),    # Bob likes big numbers
+    "charlie@demo.com": MULT5          # Charlie likes multiples of 5
+}
+
+def calculate_score_batch(user_matrix, random_matrix):
+    """Score many games at once - row i holds game i's numbers (1-99), same rules as the app's calculate_score"""
+    # Mark each game's numbers in a (games x 100) membership matrix so duplicate
+    # predictions count once, then count the cells both matrices mark per row
+    rows = np.arange(len(user_matrix))[:, None]
+    user_mask = np.zeros((len(user_matrix), 100), dtype=bool)
+    random_mask = np.zeros_like(user_mask)
+    user_mask[rows, user_matrix] = True
+    random_mask[rows, random_matrix] = True
+    return (user_mask & random_mask).sum(axis=1)
 
 def create_test_data():
     """Create dummy test data for analytics demonstration"""
     
     print("🎯 Creating test data for analytics demonstration...")
     
-    # Initialize Supabase
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SECRET_KEY")
-    supabase: Client = create_client(url, key)
+    supabase = get_supabase()
     
     # Test users - all emails normalized to lowercase
     test_users = [
@@ -44,18 +63,10 @@ def create_test_data():
             game_time = datetime.now() - timedelta(days=days_ago, hours=hours_ago, minutes=minutes_ago)
             
             # Generate predictions - simulate human behavior
-            predictions = []
-            
-            # Some users prefer certain ranges
-            if user["email"] == "alice@demo.com":
-                # Alice likes small numbers
-                predictions = [random.randint(1, 30) for _ in range(10)]
-            elif user["email"] == "bob@demo.com":
-                # Bob likes big numbers
-                predictions = [random.randint(50, 99) for _ in range(10)]
-            elif user["email"] == "charlie@demo.com":
-                # Charlie likes multiples of 5
-                predictions = [random.choice([5, 10, 15, 20, 25, 30, 35, 40, 45, 50, 55, 60, 65, 70, 75, 80, 85, 90, 95]) for _ in range(10)]
+            pool = PREDICTION_POOLS.get(user["email"])
+            if pool:
+                # Some users prefer certain ranges
+                predictions = random.choices(pool, k=10)
             else:
                 # Random selections for others
                 predictions = random.sample(range(1, 100), 10)
@@ -63,54 +74,47 @@ def create_test_data():
             # Generate truly random numbers (what the API would return)
             random_numbers = random.sample(range(1, 100), 10)
             
-            # Calculate score (matches)
-            score = len(set(predictions) & set(random_numbers))
-            
             # Create game run record
             game_run = {
                 'user_name': user['name'],
                 'email': user['email'],
                 'predictions': predictions,
                 'random_numbers': random_numbers,
-                'score': score,
                 'game_type': '1-99_range_10_numbers',
                 'created_at': game_time.isoformat()
             }
             
             all_runs.append(game_run)
     
+    # Score every game at once - every run has 10 numbers, so stream them
+    # straight into (games x 10) arrays
+    preds = np.fromiter(chain.from_iterable(run['predictions'] for run in all_runs), dtype=np.uint8).reshape(-1, 10)
+    rands = np.fromiter(chain.from_iterable(run['random_numbers'] for run in all_runs), dtype=np.uint8).reshape(-1, 10)
+    scores = calculate_score_batch(preds, rands)
+    for run, score in zip(all_runs, scores.tolist()):
+        run['score'] = score
+    
     # Insert all game runs
     try:
         print(f"Inserting {len(all_runs)} game runs...")
-        result = supabase.table('game_runs').insert(all_runs).execute()
-        print(f"✅ Successfully inserted {len(result.data)} game runs")
+        inserted = 0
+        for start in range(0, len(all_runs), BATCH_SIZE):
+            batch = all_runs[start:start + BATCH_SIZE]
+            # No need to ship the inserted rows back - the batch size is known
+            supabase.table('game_runs').insert(batch, returning='minimal').execute()
+            inserted += len(batch)
+            print(f"  • Inserted {inserted}/{len(all_runs)}")
+        print(f"✅ Successfully inserted {inserted} game runs")
         
-        # Update leaderboard for each user
+        # Rebuild leaderboard entries for all test users in one call
         print("Updating leaderboard...")
-        for user in test_users:
-            user_runs = [run for run in all_runs if run['email'] == user['email']]
-            best_score = max(run['score'] for run in user_runs)
-            total_games = len(user_runs)
-            
-            # Check if user exists in leaderboard
-            existing = supabase.table('leaderboard').select('*').eq('email', user['email']).execute()
-            
-            if existing.data:
-                # Update existing
-                supabase.table('leaderboard').update({
-                    'name': user['name'],
-                    'best_score': best_score,
-                    'total_games_played': total_games
-                }).eq('email', user['email']).execute()
-            else:
-                # Insert new
-                supabase.table('leaderboard').insert({
-                    'name': user['name'],
-                    'email': user['email'],
-                    'best_score': best_score,
-                    'total_games_played': total_games,
-                    'game_type': '1-99_range_10_numbers'
-                }).execute()
+        try:
+            # Aggregated from game_runs server-side (see database_functions.sql)
+            supabase.rpc('refresh_leaderboard', {'p_emails': [user['email'] for user in test_users]}).execute()
+        except Exception as e:
+            raise_unless_missing(e)
+            # refresh_leaderboard() not created yet - aggregate the generated runs here
+            _upsert_leaderboard_from_runs(supabase, all_runs)
         
         print("✅ Leaderboard updated successfully")
         
@@ -120,16 +124,21 @@ def create_test_data():
         print(f"• Test users: {len(test_users)}")
         print(f"• Date range: Last 30 days")
         
-        scores = [run['score'] for run in all_runs]
-        print(f"• Average score: {sum(scores)/len(scores):.1f}/10")
-        print(f"• Best score: {max(scores)}/10")
-        print(f"• Score distribution: {dict(sorted([(i, scores.count(i)) for i in range(11)]))}")
+        print(f"• Average score: {scores.mean():.1f}/10")
+        print(f"• Best score: {scores.max()}/10")
+        print(f"• Score distribution: {dict(enumerate(np.bincount(scores, minlength=11).tolist()))}")
+        
+        # Per-user games and best score in a single pass over the runs
+        user_stats = defaultdict(lambda: {'games': 0, 'best': 0})
+        for run in all_runs:
+            stats = user_stats[run['email']]
+            stats['games'] += 1
+            stats['best'] = max(stats['best'], run['score'])
         
         print("\n🎮 Test users created:")
         for user in test_users:
-            user_games = len([r for r in all_runs if r['email'] == user['email']])
-            user_best = max([r['score'] for r in all_runs if r['email'] == user['email']])
-            print(f"  • {user['name']} ({user['email']}): {user_games} games, best: {user_best}/10")
+            stats = user_stats[user['email']]
+            print(f"  • {user['name']} ({user['email']}): {stats['games']} games, best: {stats['best']}/10")
         
         print("\n✨ You can now test the analytics with rich data!")
         print("📝 To clean up later, run: python cleanup_test_data.py")
@@ -140,13 +149,29 @@ def create_test_data():
     
     return True
 
+def _upsert_leaderboard_from_runs(supabase, all_runs):
+    """Upsert one leaderboard entry per email aggregated from the generated runs"""
+    leaderboard_rows = {}
+    for run in all_runs:
+        row = leaderboard_rows.setdefault(run['email'], {
+            'name': run['user_name'],
+            'email': run['email'],
+            'best_score': 0,
+            'total_games_played': 0,
+            'game_type': run['game_type']
+        })
+        row['best_score'] = max(row['best_score'], run['score'])
+        row['total_games_played'] += 1
+    
+    supabase.table('leaderboard').upsert(
+        list(leaderboard_rows.values()), on_conflict='email,game_type', returning='minimal'
+    ).execute()
+
 def cleanup_test_data():
     """Remove all test data"""
     print("🧹 Cleaning up test data...")
     
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SECRET_KEY") 
-    supabase: Client = create_client(url, key)
+    supabase = get_supabase()
     
     test_emails = [
         "alice@demo.com", "bob@demo.com", "charlie@demo.com", 
@@ -154,16 +179,12 @@ def cleanup_test_data():
     ]
     
     try:
-        # Remove from game_runs
-        for email in test_emails:
-            supabase.table('game_runs').delete().eq('email', email).execute()
-        
-        # Remove from leaderboard
-        for email in test_emails:
-            supabase.table('leaderboard').delete().eq('email', email).execute()
-        
+        # One bulk delete per table instead of one per email, both tables in parallel
+        for_each_table(
+            ('game_runs', 'leaderboard'),
+            lambda table: supabase.table(table).delete(returning='minimal').in_('email', test_emails).execute()
+        )
         print("✅ Test data cleaned up successfully")
-        
     except Exception as e:
         print(f"❌ Error cleaning up test data: {e}")
 
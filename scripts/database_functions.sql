@@ -0,0 +1,243 @@
+-- Server-side aggregate functions for analytics
+-- Run this AFTER database_analytics_schema.sql (safe to re-run)
+
+-- Function: Prediction and random number frequencies for a game type
+-- Returns at most 2 x 99 rows instead of shipping every game run to the client
+CREATE OR REPLACE FUNCTION number_frequencies(gt TEXT)
+RETURNS TABLE(kind TEXT, n INTEGER, c BIGINT) AS $$
+    SELECT 'pred', p.num::INTEGER, COUNT(*)
+    FROM game_runs, jsonb_array_elements_text(predictions) AS p(num)
+    WHERE game_type = gt
+    GROUP BY 2
+    UNION ALL
+    SELECT 'rand', r.num::INTEGER, COUNT(*)
+    FROM game_runs, jsonb_array_elements_text(random_numbers) AS r(num)
+    WHERE game_type = gt
+    GROUP BY 2;
+$$ LANGUAGE sql STABLE;
+
+-- Function: Headline statistics for the global analytics page
+-- Returns a single JSON object instead of every game run
+CREATE OR REPLACE FUNCTION global_stats(gt TEXT)
+RETURNS JSON AS $$
+    SELECT json_build_object(
+        'total_games', COUNT(*),
+        'avg_score', AVG(score),
+        'best_score', MAX(score),
+        'total_players', COUNT(DISTINCT email),
+        'score_distribution', (
+            SELECT json_object_agg(s.score, s.c ORDER BY s.score)
+            FROM (
+                SELECT score, COUNT(*) AS c
+                FROM game_runs
+                WHERE game_type = gt
+                GROUP BY score
+            ) s
+        )
+    )
+    FROM game_runs
+    WHERE game_type = gt;
+$$ LANGUAGE sql STABLE;
+
+-- Function: Aggregate statistics for one player's analytics page
+-- Favorite numbers are counted and the latest runs included here, so the dashboard makes one call
+CREATE OR REPLACE FUNCTION user_stats(p_email TEXT, gt TEXT)
+RETURNS JSON AS $$
+    SELECT json_build_object(
+        'total_games', COUNT(*),
+        'best_score', MAX(score),
+        'avg_score', AVG(score),
+        'first_game', MIN(created_at),
+        'games_last_week', COUNT(*) FILTER (WHERE created_at > NOW() - INTERVAL '7 days'),
+        'favorite_numbers', (
+            SELECT json_agg(json_build_array(f.num, f.c) ORDER BY f.c DESC, f.num)
+            FROM (
+                SELECT p.num::INTEGER AS num, COUNT(*) AS c
+                FROM game_runs, jsonb_array_elements_text(predictions) AS p(num)
+                WHERE email = p_email AND game_type = gt
+                GROUP BY 1
+                ORDER BY c DESC, num
+                LIMIT 10
+            ) f
+        ),
+        -- Latest runs for the trend chart and history table
+        'recent_runs', (
+            SELECT json_agg(r ORDER BY r.created_at DESC)
+            FROM (
+                SELECT created_at, score, predictions, random_numbers
+                FROM game_runs
+                WHERE email = p_email AND game_type = gt
+                ORDER BY created_at DESC
+                LIMIT 10
+            ) r
+        )
+    )
+    FROM game_runs
+    WHERE email = p_email AND game_type = gt;
+$$ LANGUAGE sql STABLE;
+
+-- Materialized view: Precomputed global analytics payload, one row per game type
+-- The analytics page reads a single row instead of aggregating on every load
+CREATE MATERIALIZED VIEW IF NOT EXISTS mv_global_analytics AS
+SELECT
+    g.game_type,
+    global_stats(g.game_type) AS stats,
+    (SELECT json_agg(f) FROM number_frequencies(g.game_type) f) AS frequencies,
+    NOW() AS refreshed_at
+FROM (SELECT DISTINCT game_type FROM game_runs) g;
+
+-- Unique index (required for REFRESH ... CONCURRENTLY)
+CREATE UNIQUE INDEX IF NOT EXISTS idx_mv_global_analytics_game_type ON mv_global_analytics(game_type);
+
+GRANT SELECT ON mv_global_analytics TO anon, authenticated, service_role;
+
+-- Refresh every 5 minutes without blocking readers
+-- Requires the pg_cron extension (Database > Extensions in the Supabase dashboard)
+CREATE EXTENSION IF NOT EXISTS pg_cron;
+SELECT cron.schedule(
+    'refresh-mv-global-analytics',
+    '*/5 * * * *',
+    'REFRESH MATERIALIZED VIEW CONCURRENTLY mv_global_analytics'
+);
+
+-- Unique key for leaderboard upserts (ON CONFLICT (email, game_type))
+-- Replaces the original UNIQUE(email, game_type) constraint, which fix_email_duplicates.sql
+-- may already have dropped, so the table always has exactly one such index.
+-- fix_email_duplicates.sql's LOWER(email) expression index can't be an ON CONFLICT target;
+-- emails are lowercase anyway
+CREATE UNIQUE INDEX IF NOT EXISTS idx_leaderboard_email_game_type ON leaderboard(email, game_type);
+ALTER TABLE leaderboard DROP CONSTRAINT IF EXISTS leaderboard_email_game_type_key;
+
+-- Covering index for the sidebar top 10 (game_type filter, best_score DESC order)
+-- INCLUDE (name) lets Postgres answer it with an index-only scan
+CREATE INDEX IF NOT EXISTS idx_leaderboard_top_scores ON leaderboard(game_type, best_score DESC) INCLUDE (name);
+DROP INDEX IF EXISTS idx_leaderboard_score_game_type;
+
+-- Function: Lowercase and trim every stored email in one statement per table
+-- Returns the leaderboard changes (for the audit log) and the game_runs count
+CREATE OR REPLACE FUNCTION normalize_emails()
+RETURNS JSON AS $$
+    WITH lb AS (
+        UPDATE leaderboard l
+        SET email = LOWER(BTRIM(o.email))
+        FROM (SELECT id, email FROM leaderboard WHERE email <> LOWER(BTRIM(email))) o
+        WHERE l.id = o.id
+        RETURNING o.email AS old_email, l.email AS new_email
+    ), gr AS (
+        UPDATE game_runs
+        SET email = LOWER(BTRIM(email))
+        WHERE email <> LOWER(BTRIM(email))
+        RETURNING id
+    )
+    SELECT json_build_object(
+        'leaderboard', (SELECT json_agg(json_build_array(old_email, new_email)) FROM lb),
+        'game_runs', (SELECT COUNT(*) FROM gr)
+    );
+$$ LANGUAGE sql VOLATILE;
+
+-- Function: Rebuild leaderboard entries for the given players from their game runs
+-- One atomic INSERT ... ON CONFLICT instead of a select/update/insert per player
+CREATE OR REPLACE FUNCTION refresh_leaderboard(p_emails TEXT[])
+RETURNS VOID AS $$
+    INSERT INTO leaderboard (name, email, best_score, total_games_played, game_type)
+    SELECT
+        (ARRAY_AGG(user_name ORDER BY created_at DESC))[1],
+        email,
+        MAX(score),
+        COUNT(*),
+        game_type
+    FROM game_runs
+    WHERE email = ANY(p_emails)
+    GROUP BY email, game_type
+    ON CONFLICT (email, game_type) DO UPDATE SET
+        name = EXCLUDED.name,
+        best_score = EXCLUDED.best_score,
+        total_games_played = EXCLUDED.total_games_played,
+        updated_at = NOW();
+$$ LANGUAGE sql VOLATILE;
+
+-- Function: Everything verify_before_fix.py reports on, in one call
+-- Only leaderboard rows in groups with duplicates, case variations or
+-- non-normalized emails are returned; everything else is just counted
+CREATE OR REPLACE FUNCTION report_email_issues()
+RETURNS JSON AS $$
+    SELECT json_build_object(
+        'leaderboard_total', (SELECT COUNT(*) FROM leaderboard),
+        'leaderboard_entries', (
+            SELECT COALESCE(json_agg(e ORDER BY e.id), '[]'::json)
+            FROM (
+                SELECT id, email, game_type, name, best_score, total_games_played
+                FROM leaderboard
+                WHERE LOWER(BTRIM(email)) IN (
+                    SELECT LOWER(BTRIM(email))
+                    FROM leaderboard
+                    GROUP BY 1
+                    HAVING COUNT(DISTINCT email) > 1
+                        OR COUNT(*) > COUNT(DISTINCT game_type)
+                        OR BOOL_OR(email <> LOWER(BTRIM(email)))
+                )
+            ) e
+        ),
+        'game_runs_total', (SELECT COUNT(*) FROM game_runs),
+        'game_runs_unnormalized', (SELECT COUNT(*) FROM game_runs WHERE email <> LOWER(BTRIM(email)))
+    );
+$$ LANGUAGE sql STABLE;
+
+-- Function: Record a finished game on the leaderboard in one atomic statement
+-- Returns the player's previous best score (NULL for a new entry)
+CREATE OR REPLACE FUNCTION save_score(p_name TEXT, p_email TEXT, p_score INTEGER, p_game_type TEXT)
+RETURNS INTEGER AS $$
+    WITH previous AS (
+        SELECT best_score FROM leaderboard WHERE email = p_email AND game_type = p_game_type
+    ), saved AS (
+        INSERT INTO leaderboard (name, email, best_score, total_games_played, game_type)
+        VALUES (p_name, p_email, p_score, 1, p_game_type)
+        ON CONFLICT (email, game_type) DO UPDATE SET
+            name = CASE WHEN EXCLUDED.best_score > leaderboard.best_score THEN EXCLUDED.name ELSE leaderboard.name END,
+            best_score = GREATEST(leaderboard.best_score, EXCLUDED.best_score),
+            total_games_played = leaderboard.total_games_played + 1,
+            updated_at = NOW()
+    )
+    SELECT best_score FROM previous;
+$$ LANGUAGE sql VOLATILE;
+
+-- Function: Merge leaderboard entries whose emails differ only by case/whitespace
+-- Keeps the best entry of each (email, game_type) group with the groups' games played
+-- summed, and deletes the rest, all in one transaction. Emails are left for normalize_emails().
+-- Returns each merged group with its entries, the kept one first
+CREATE OR REPLACE FUNCTION fix_leaderboard_duplicates()
+RETURNS JSON AS $$
+    WITH ranked AS (
+        SELECT
+            id, name, email, game_type, best_score, total_games_played,
+            LOWER(BTRIM(email)) AS normalized_email,
+            ROW_NUMBER() OVER (g ORDER BY best_score DESC, total_games_played DESC, id) AS rn,
+            COUNT(*) OVER g AS entries,
+            SUM(total_games_played) OVER g AS total
+        FROM leaderboard
+        WINDOW g AS (PARTITION BY LOWER(BTRIM(email)), game_type)
+    ), duplicates AS (
+        SELECT * FROM ranked WHERE entries > 1
+    ), merged AS (
+        UPDATE leaderboard l
+        SET total_games_played = d.total, updated_at = NOW()
+        FROM duplicates d
+        WHERE l.id = d.id AND d.rn = 1
+    ), deleted AS (
+        DELETE FROM leaderboard l
+        USING duplicates d
+        WHERE l.id = d.id AND d.rn > 1
+    )
+    SELECT COALESCE(json_agg(grp ORDER BY grp.email, grp.game_type), '[]'::json)
+    FROM (
+        SELECT
+            normalized_email AS email,
+            game_type,
+            json_agg(json_build_object(
+                'id', id, 'name', name, 'email', email,
+                'best_score', best_score, 'total_games_played', total_games_played
+            ) ORDER BY rn) AS entries
+        FROM duplicates
+        GROUP BY normalized_email, game_type
+    ) grp;
+$$ LANGUAGE sql VOLATILE;
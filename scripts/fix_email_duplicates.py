@@ -4,110 +4,54 @@ Fix email duplicate entries in the leaderboard.
 This script normalizes all emails to lowercase and merges duplicate entries.
 """
 
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase_client import get_supabase, raise_unless_missing
 import sys
+from collections import defaultdict
 
-# Load environment variables
-load_dotenv()
-
-# Initialize Supabase client
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_SECRET_KEY")
-
-if not url or not key:
-    print("❌ Error: Missing Supabase credentials in .env file")
-    sys.exit(1)
-
-supabase: Client = create_client(url, key)
+supabase = get_supabase()
 
 def fix_duplicates():
     """Fix duplicate email entries in the leaderboard"""
     try:
-        print("🔍 Fetching all leaderboard entries...")
+        print("🔍 Merging duplicate leaderboard entries...")
         
-        # Get all leaderboard entries
-        all_entries = supabase.table('leaderboard').select('*').execute()
+        try:
+            # Keep, sum and delete in one transaction server-side (see database_functions.sql)
+            groups = supabase.rpc('fix_leaderboard_duplicates').execute().data
+        except Exception as e:
+            raise_unless_missing(e)
+            # fix_leaderboard_duplicates() not created yet - merge from the client
+            groups = _merge_duplicates_by_rows()
         
-        if not all_entries.data:
-            print("No entries found in leaderboard")
-            return
-        
-        # Group by normalized email
-        email_groups = {}
-        for entry in all_entries.data:
-            normalized_email = entry['email'].strip().lower()
-            game_type = entry['game_type']
-            key = f"{normalized_email}|{game_type}"
-            
-            if key not in email_groups:
-                email_groups[key] = []
-            email_groups[key].append(entry)
+        for group in groups:
+            best_entry, *duplicates = group['entries']
+            print(f"\n⚠️  Found {len(group['entries'])} entries for {group['email']} ({group['game_type']}):")
+            print(f"  ✅ Keeping: {best_entry['name']} - Score: {best_entry['best_score']}, Games: {best_entry['total_games_played']}")
+            for duplicate in duplicates:
+                print(f"  ❌ Deleting: {duplicate['name']} - Score: {duplicate['best_score']}, Games: {duplicate['total_games_played']}")
         
-        # Find duplicates
-        duplicates_found = False
-        for key, entries in email_groups.items():
-            if len(entries) > 1:
-                duplicates_found = True
-                email, game_type = key.split('|')
-                print(f"\n⚠️  Found {len(entries)} entries for {email} ({game_type}):")
-                
-                # Sort by best score descending, then total games
-                entries.sort(key=lambda x: (x['best_score'], x['total_games_played']), reverse=True)
-                
-                # Keep the best entry
-                best_entry = entries[0]
-                print(f"  ✅ Keeping: {best_entry['name']} - Score: {best_entry['best_score']}, Games: {best_entry['total_games_played']}")
-                
-                # Update the best entry with normalized email and aggregate games played
-                total_games = sum(e['total_games_played'] for e in entries)
-                
-                # Update the best entry
-                supabase.table('leaderboard').update({
-                    'email': email,  # Normalized email
-                    'total_games_played': total_games,
-                    'name': best_entry['name']  # Keep the name from best score entry
-                }).eq('id', best_entry['id']).execute()
-                
-                # Delete the duplicates
-                for duplicate in entries[1:]:
-                    print(f"  ❌ Deleting: {duplicate['name']} - Score: {duplicate['best_score']}, Games: {duplicate['total_games_played']}")
-                    supabase.table('leaderboard').delete().eq('id', duplicate['id']).execute()
-        
-        if not duplicates_found:
+        if not groups:
             print("✅ No duplicates found!")
         else:
             print("\n✅ Duplicates have been fixed!")
         
-        # Normalize all remaining emails
+        # Normalize all remaining emails (leaderboard and game_runs)
         print("\n🔧 Normalizing all email addresses...")
-        remaining = supabase.table('leaderboard').select('*').execute()
+        try:
+            # One UPDATE per table server-side (see database_functions.sql)
+            normalized = supabase.rpc('normalize_emails').execute().data
+        except Exception as e:
+            raise_unless_missing(e)
+            # normalize_emails() not created yet - update the rows one by one
+            normalized = _normalize_emails_by_row()
         
-        for entry in remaining.data:
-            if entry['email'] != entry['email'].strip().lower():
-                supabase.table('leaderboard').update({
-                    'email': entry['email'].strip().lower()
-                }).eq('id', entry['id']).execute()
-                print(f"  Normalized: {entry['email']} → {entry['email'].strip().lower()}")
+        for old_email, new_email in normalized['leaderboard'] or []:
+            print(f"  Normalized: {old_email} → {new_email}")
         
         print("\n✅ All emails have been normalized!")
         
-        # Also normalize emails in game_runs table
-        print("\n🔧 Normalizing emails in game_runs table...")
-        game_runs = supabase.table('game_runs').select('id, email').execute()
-        
-        normalized_count = 0
-        for run in game_runs.data:
-            normalized = run['email'].strip().lower()
-            if run['email'] != normalized:
-                supabase.table('game_runs').update({
-                    'email': normalized
-                }).eq('id', run['id']).execute()
-                normalized_count += 1
-        
-        if normalized_count > 0:
-            print(f"  Normalized {normalized_count} game run emails")
+        if normalized['game_runs'] > 0:
+            print(f"  Normalized {normalized['game_runs']} game run emails")
         
         print("\n✅ Database cleanup complete!")
         
@@ -115,6 +59,56 @@ def fix_duplicates():
         print(f"❌ Error: {e}")
         sys.exit(1)
 
+def _merge_duplicates_by_rows():
+    """Merge duplicates from the client, returning the same shape as fix_leaderboard_duplicates()"""
+    all_entries = supabase.table('leaderboard').select('id, name, email, game_type, best_score, total_games_played').execute()
+    
+    # Group by normalized email (normalized once per row, kept in the key)
+    email_groups = defaultdict(list)
+    for entry in all_entries.data:
+        email_groups[(entry['email'].strip().lower(), entry['game_type'])].append(entry)
+    
+    groups = []
+    update_rows = []
+    delete_ids = []
+    for (email, game_type), entries in email_groups.items():
+        if len(entries) > 1:
+            # Best entry first (highest score, then most games)
+            entries.sort(key=lambda x: (-x['best_score'], -x['total_games_played'], x['id']))
+            groups.append({'email': email, 'game_type': game_type, 'entries': entries})
+            
+            # The kept entry takes the group's games played; its email is normalized afterwards
+            update_rows.append({**entries[0], 'total_games_played': sum(e['total_games_played'] for e in entries)})
+            delete_ids.extend(e['id'] for e in entries[1:])
+    
+    if groups:
+        # Save the merged totals before deleting anything, so a failure in between
+        # leaves extra rows rather than lost games
+        supabase.table('leaderboard').upsert(update_rows, returning='minimal').execute()
+        supabase.table('leaderboard').delete(returning='minimal').in_('id', delete_ids).execute()
+    
+    return groups
+
+def _normalize_emails_by_row():
+    """Normalize emails one row at a time, returning the same shape as normalize_emails()"""
+    leaderboard_changes = []
+    remaining = supabase.table('leaderboard').select('id, email').execute()
+    for entry in remaining.data:
+        normalized = entry['email'].strip().lower()
+        if entry['email'] != normalized:
+            supabase.table('leaderboard').update({'email': normalized}, returning='minimal').eq('id', entry['id']).execute()
+            leaderboard_changes.append((entry['email'], normalized))
+    
+    normalized_count = 0
+    game_runs = supabase.table('game_runs').select('id, email').execute()
+    for run in game_runs.data:
+        normalized = run['email'].strip().lower()
+        if run['email'] != normalized:
+            supabase.table('game_runs').update({'email': normalized}, returning='minimal').eq('id', run['id']).execute()
+            normalized_count += 1
+    
+    return {'leaderboard': leaderboard_changes, 'game_runs': normalized_count}
+
 if __name__ == "__main__":
     print("=== Email Duplicate Fix Script ===")
     print("This will:")
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Shared Supabase client for the maintenance scripts.
+Every script reuses one client, so all of its requests share the same pooled connections.
+"""
+
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+import httpx
+from dotenv import load_dotenv
+from supabase import create_client, Client, ClientOptions, PostgrestAPIError
+
+load_dotenv()
+
+# Read the credentials once at import so every script fails fast with the same message
+try:
+    SUPABASE_URL = os.environ["SUPABASE_URL"]
+    SUPABASE_SECRET_KEY = os.environ["SUPABASE_SECRET_KEY"]
+except KeyError as e:
+    print(f"❌ Error: Missing {e.args[0]} in .env file")
+    sys.exit(1)
+
+# PostgREST/Postgres error codes for a function, table or view that doesn't exist
+MISSING_OBJECT_CODES = frozenset({'PGRST202', 'PGRST205', '42883', '42P01'})
+
+def raise_unless_missing(error):
+    """Re-raise the error unless it says a database function, table or view isn't installed"""
+    if not (isinstance(error, PostgrestAPIError) and error.code in MISSING_OBJECT_CODES):
+        raise error
+
+@lru_cache(maxsize=1)
+def get_supabase() -> Client:
+    """Create the Supabase client once and reuse it for every call"""
+    # Keep connections alive across the pauses between script steps (e.g. confirmation prompts)
+    http_client = httpx.Client(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=40, keepalive_expiry=40)
+    )
+    return create_client(SUPABASE_URL, SUPABASE_SECRET_KEY, options=ClientOptions(httpx_client=http_client))
+
+def for_each_table(tables, action):
+    """Run an action against every table concurrently, returning the results in table order"""
+    # The tables are independent, so their requests can overlap
+    with ThreadPoolExecutor(max_workers=len(tables)) as pool:
+        futures = [pool.submit(action, table) for table in tables]
+    
+    # Wait for every table before reporting, so one failure names all the failed tables
+    results = []
+    errors = []
+    for table, future in zip(tables, futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            errors.append(f"{table}: {e}")
+    if errors:
+        raise Exception("; ".join(errors))
+    return results
@@ -1,33 +1,20 @@
 #!/usr/bin/env python3
 
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase_client import get_supabase
 import json
 
-load_dotenv()
-
 def test_analytics_setup():
     """Test the new analytics database setup"""
     
     print("🚀 Testing Analytics Database Setup...")
     
-    # Get environment variables
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SECRET_KEY")
-    
-    if not url or not key:
-        print("❌ Missing SUPABASE_URL or SUPABASE_SECRET_KEY in .env")
-        return False
-    
     try:
-        # Create Supabase client
-        supabase: Client = create_client(url, key)
+        supabase = get_supabase()
         print("✅ Connected to Supabase successfully")
         
         # Test existing leaderboard table
         try:
-            result = supabase.table('leaderboard').select("*").limit(1).execute()
+            result = supabase.table('leaderboard').select("id").limit(1).execute()
             print("✅ Existing leaderboard table is accessible")
         except Exception as e:
             print(f"❌ Leaderboard table error: {e}")
@@ -35,7 +22,7 @@ def test_analytics_setup():
         
         # Test new game_runs table
         try:
-            result = supabase.table('game_runs').select("*").limit(1).execute()
+            result = supabase.table('game_runs').select("id").limit(1).execute()
             print("✅ New game_runs table exists and is accessible")
             
             # Test inserting a sample game run
@@ -1,34 +1,16 @@
 #!/usr/bin/env python3
 
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
-
-load_dotenv()
+from supabase_client import get_supabase
 
 def test_database_setup():
     """Test Supabase connection and create table"""
     
-    # Get environment variables
-    url = os.getenv("SUPABASE_URL")
-    key = os.getenv("SUPABASE_SECRET_KEY")
-    
-    if not url or not key:
-        print("❌ Missing SUPABASE_URL or SUPABASE_SECRET_KEY in .env")
-        return False
-    
     try:
-        # Create Supabase client
-        supabase: Client = create_client(url, key)
+        supabase = get_supabase()
         print("✅ Connected to Supabase successfully")
         
-        # Read and execute SQL
-        with open('database_setup.sql', 'r') as file:
-            sql_content = file.read()
-        
-        # Execute the SQL (Note: supabase-py doesn't support raw SQL execution easily)
-        # We'll test connection by trying a simple query instead
-        result = supabase.table('leaderboard').select("*").limit(1).execute()
+        # supabase-py can't execute raw SQL, so test the table with a simple query instead
+        result = supabase.table('leaderboard').select("id").limit(1).execute()
         print("✅ Database table exists and is accessible")
         return True
         
@@ -5,24 +5,53 @@ This script ONLY READS from your database and verifies assumptions.
 It does NOT modify any data. Run this first to ensure the fix will work correctly.
 """
 
-import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase_client import get_supabase, raise_unless_missing
 import sys
 from collections import defaultdict
 
-# Load environment variables
-load_dotenv()
+supabase = get_supabase()
 
-# Initialize Supabase client
-url = os.getenv("SUPABASE_URL")
-key = os.getenv("SUPABASE_SECRET_KEY")
+# Rows per request - matches Supabase's default max rows per response
+PAGE_SIZE = 1000
 
-if not url or not key:
-    print("❌ Error: Missing Supabase credentials in .env file")
-    sys.exit(1)
+def iter_rows(table, columns):
+    """Yield every row of a table, fetching PAGE_SIZE rows per request"""
+    start = 0
+    while True:
+        page = supabase.table(table).select(columns).order('id').range(start, start + PAGE_SIZE - 1).execute().data
+        yield from page
+        if len(page) < PAGE_SIZE:
+            return
+        start += PAGE_SIZE
 
-supabase: Client = create_client(url, key)
+def fetch_email_report():
+    """Fetch the leaderboard rows and game run counts the report needs"""
+    try:
+        # Only the problem rows and the counts are returned (see database_functions.sql)
+        return supabase.rpc('report_email_issues').execute().data
+    except Exception as e:
+        raise_unless_missing(e)
+        # report_email_issues() not created yet - build the report from full table scans
+        return _build_email_report()
+
+def _build_email_report():
+    """Build the same report as report_email_issues() from full table scans"""
+    leaderboard = list(iter_rows('leaderboard', 'id, email, game_type, name, best_score, total_games_played'))
+    
+    # Stream game runs page by page - only the counts are kept
+    total_runs = 0
+    non_normalized_runs = 0
+    for run in iter_rows('game_runs', 'id, email'):
+        total_runs += 1
+        if run['email'] != run['email'].strip().lower():
+            non_normalized_runs += 1
+    
+    return {
+        'leaderboard_total': len(leaderboard),
+        'leaderboard_entries': leaderboard,
+        'game_runs_total': total_runs,
+        'game_runs_unnormalized': non_normalized_runs
+    }
 
 def verify_database_state():
     """Verify current database state and check for potential issues"""
@@ -41,26 +70,27 @@ def verify_database_state():
         print("📊 ANALYZING LEADERBOARD TABLE...")
         print("-" * 40)
         
-        leaderboard = supabase.table('leaderboard').select('*').execute()
+        report = fetch_email_report()
         
-        if not leaderboard.data:
+        if not report['leaderboard_total']:
             print("⚠️  Leaderboard is empty")
             return
         
-        print(f"Total entries: {len(leaderboard.data)}")
+        print(f"Total entries: {report['leaderboard_total']}")
         
-        # Group by normalized email
+        # Group by normalized email and collect non-normalized entries in one pass
         email_groups = defaultdict(list)
         case_variations = defaultdict(set)
+        non_normalized = []
         
-        for entry in leaderboard.data:
+        for entry in report['leaderboard_entries']:
             original_email = entry['email']
             normalized_email = original_email.strip().lower()
-            game_type = entry['game_type']
-            key = f"{normalized_email}|{game_type}"
             
-            email_groups[key].append(entry)
+            email_groups[(normalized_email, entry['game_type'])].append(entry)
             case_variations[normalized_email].add(original_email)
+            if original_email != normalized_email:
+                non_normalized.append((entry, normalized_email))
         
         # Check for duplicates
         duplicate_count = 0
@@ -69,26 +99,24 @@ def verify_database_state():
         print("\n🔍 DUPLICATE ANALYSIS:")
         print("-" * 40)
         
-        for key, entries in email_groups.items():
+        for (email, game_type), entries in email_groups.items():
             if len(entries) > 1:
                 duplicate_count += 1
-                email, game_type = key.split('|')
                 affected_emails.append(email)
                 
                 print(f"\n❗ Duplicate found: {email} ({game_type})")
                 print(f"   Number of duplicate entries: {len(entries)}")
                 
                 # Show details of each duplicate
-                entries_sorted = sorted(entries, key=lambda x: (x['best_score'], x['total_games_played']), reverse=True)
+                best_entry = max(entries, key=lambda x: (x['best_score'], x['total_games_played']))
                 
-                for i, entry in enumerate(entries_sorted):
-                    status = "✅ KEEP" if i == 0 else "❌ DELETE"
+                for entry in entries:
+                    status = "✅ KEEP" if entry is best_entry else "❌ DELETE"
                     print(f"   {status}: ID={entry['id']}, Name='{entry['name']}', "
                           f"Email='{entry['email']}', Score={entry['best_score']}, "
                           f"Games={entry['total_games_played']}")
                 
                 # Calculate what will happen
-                best_entry = entries_sorted[0]
                 total_games = sum(e['total_games_played'] for e in entries)
                 print(f"   📊 After merge: Name='{best_entry['name']}', "
                       f"Score={best_entry['best_score']}, "
@@ -118,11 +146,8 @@ def verify_database_state():
         print("\n🔍 NON-NORMALIZED EMAILS:")
         print("-" * 40)
         
-        non_normalized = []
-        for entry in leaderboard.data:
-            if entry['email'] != entry['email'].strip().lower():
-                non_normalized.append(entry)
-                print(f"⚠️  ID={entry['id']}: '{entry['email']}' → '{entry['email'].strip().lower()}'")
+        for entry, normalized_email in non_normalized:
+            print(f"⚠️  ID={entry['id']}: '{entry['email']}' → '{normalized_email}'")
         
         if non_normalized:
             warnings.append(f"Found {len(non_normalized)} non-normalized emails")
@@ -133,15 +158,11 @@ def verify_database_state():
         print("\n📊 ANALYZING GAME_RUNS TABLE...")
         print("-" * 40)
         
-        game_runs = supabase.table('game_runs').select('id, email, user_name').execute()
+        total_runs = report['game_runs_total']
+        non_normalized_runs = report['game_runs_unnormalized']
         
-        if game_runs.data:
-            print(f"Total game runs: {len(game_runs.data)}")
-            
-            non_normalized_runs = 0
-            for run in game_runs.data:
-                if run['email'] != run['email'].strip().lower():
-                    non_normalized_runs += 1
+        if total_runs:
+            print(f"Total game runs: {total_runs}")
             
             if non_normalized_runs > 0:
                 warnings.append(f"Found {non_normalized_runs} non-normalized emails in game_runs")
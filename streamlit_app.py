@@ -1,46 +1,115 @@
 import streamlit as st
 import os
+import httpx
 from dotenv import load_dotenv
-from supabase import create_client, Client
+from supabase import create_client, Client, ClientOptions
 from api_client import RandomOrgClient
 from analytics import (
-    save_game_run, update_leaderboard, show_global_analytics, 
-    show_user_analytics
+    save_game_run, update_leaderboard, start_game_run_writer,
+    show_global_analytics, show_user_analytics
 )
 
 load_dotenv()
 
+TABS = ("🎮 Play Game", "📊 Global Analytics", "👤 My Analytics")
+MEDALS = ("🥇", "🥈", "🥉") + tuple(f"**{i}.**" for i in range(4, 11))
+
+# Session keys of the game in progress, and of the player (kept between games)
+RESET_KEYS = frozenset({'game_state', 'user_numbers', 'unique_count', 'random_numbers', 'matches', 'score'})
+PLAYER_KEYS = frozenset({'user_name', 'user_email'})
+
+# Starting session values - immutable, since every session shares these objects
+SESSION_DEFAULTS = {
+    'game_state': 'input',  # 'input', 'user_details', 'results'
+    'user_numbers': (),
+    'unique_count': None,  # set when the numbers are submitted
+    'random_numbers': (),
+    'matches': (),
+    'score': 0,
+    'user_name': "",
+    'user_email': ""
+}
+
 @st.cache_resource
 def init_supabase():
     """Initialize Supabase client"""
     url = os.getenv("SUPABASE_URL")
     key = os.getenv("SUPABASE_SECRET_KEY")
-    return create_client(url, key)
+    # One long-lived HTTP/2 connection pool shared by every session's queries
+    http_client = httpx.Client(
+        http2=True,
+        timeout=10,
+        limits=httpx.Limits(max_keepalive_connections=16, keepalive_expiry=60)
+    )
+    client = create_client(url, key, options=ClientOptions(httpx_client=http_client))
+    # Game runs are queued and written in batches alongside the app
+    start_game_run_writer(client)
+    return client
 
 @st.cache_resource
 def init_random_client():
     """Initialize Random.org client"""
-    return RandomOrgClient()
+    client = RandomOrgClient()
+    # Fetch draws ahead of time so a game doesn't wait on the Random.org round-trip
+    client.start_prefetch()
+    return client
 
 def calculate_score(user_numbers, random_numbers):
     """Calculate how many numbers match - handles duplicates correctly"""
-    # Convert to sets to avoid counting duplicates multiple times
-    user_set = set(user_numbers)
-    random_set = set(random_numbers)
-    
-    # Count actual unique matches
-    matches = len(user_set.intersection(random_set))
-    return matches
+    # Intersect with a set so duplicate predictions only count once - for ten numbers
+    # this C-level intersection is faster than building int bitmasks in a Python loop
+    return len(frozenset(random_numbers).intersection(user_numbers))
+
+def count_zeros_and_unique(numbers):
+    """Count zero entries and distinct non-zero numbers"""
+    zeros = numbers.count(0)
+    return zeros, len(set(numbers)) - (zeros > 0)
 
-@st.cache_data(ttl=60)
+@st.cache_data(ttl=60, show_spinner=False)
 def get_leaderboard(_supabase: Client, game_type="1-99_range_10_numbers"):
     """Fetch leaderboard from database"""
     try:
         result = _supabase.table('leaderboard').select('name, best_score').eq('game_type', game_type).order('best_score', desc=True).limit(10).execute()
-        return result.data
+        # (name, best_score) pairs - smaller than the row dicts and cheaper for the cache to copy
+        return tuple((row['name'], row['best_score']) for row in result.data)
     except Exception as e:
         st.error(f"Error fetching leaderboard: {e}")
-        return []
+        return ()
+
+def clear_keys(keys):
+    """Delete the given keys from session state (used as a button callback)"""
+    for key in keys.intersection(st.session_state.keys()):
+        del st.session_state[key]
+
+def finish_game(supabase: Client):
+    """Save the finished game for the current player and move on to the results"""
+    # Worked out once here rather than on every rerun of the results screen
+    st.session_state.matches = sorted(
+        frozenset(st.session_state.user_numbers).intersection(st.session_state.random_numbers)
+    )
+    
+    # Queue game run for analytics - written in the background, so the
+    # only round-trip the player waits for is the leaderboard update
+    save_game_run(
+        st.session_state.user_name,
+        st.session_state.user_email,
+        st.session_state.user_numbers,
+        st.session_state.random_numbers,
+        st.session_state.score
+    )
+    
+    # Update leaderboard
+    leaderboard_changed, _ = update_leaderboard(
+        supabase,
+        st.session_state.user_name,
+        st.session_state.user_email,
+        st.session_state.score
+    )
+    if leaderboard_changed:
+        # New best score - show it in the sidebar instead of waiting out the cache
+        get_leaderboard.clear()
+    
+    st.session_state.game_state = 'results'
 
 def show_game_tab(supabase: Client, random_client: RandomOrgClient):
     """Display the main game interface"""
@@ -48,71 +117,69 @@ def show_game_tab(supabase: Client, random_client: RandomOrgClient):
     st.markdown("### 🎯 Predict 10 numbers between 1-99 and see how many match!")
     
     # Game state management
-    if 'game_state' not in st.session_state:
-        st.session_state.game_state = 'input'  # 'input', 'user_details', 'results'
-    if 'user_numbers' not in st.session_state:
-        st.session_state.user_numbers = []
-    if 'random_numbers' not in st.session_state:
-        st.session_state.random_numbers = []
-    if 'score' not in st.session_state:
-        st.session_state.score = 0
-    if 'user_name' not in st.session_state:
-        st.session_state.user_name = ""
-    if 'user_email' not in st.session_state:
-        st.session_state.user_email = ""
+    for key, value in SESSION_DEFAULTS.items():
+        st.session_state.setdefault(key, value)
 
     # Phase 1: Number input
     if st.session_state.game_state == 'input':
         st.markdown("#### Enter your 10 unique predictions (1-99):")
         st.markdown("*We use the **Random.org API** to generate truly random numbers.*")
         
-        # Input fields for 10 numbers in a nice grid
-        cols = st.columns(5)
-        user_numbers = []
-        
-        for i in range(10):
-            col_idx = i % 5
-            with cols[col_idx]:
-                num = st.number_input(
-                    f"#{i+1}", 
-                    min_value=0, 
-                    max_value=99, 
-                    value=0,
-                    key=f"num_{i}",
-                    help="Choose a number between 1-99"
-                )
-                user_numbers.append(num)
-        
-        # Check for invalid numbers (zeros) and duplicates
-        zeros_count = user_numbers.count(0)
-        valid_numbers = [n for n in user_numbers if n > 0]
-        unique_predictions = len(set(valid_numbers))
-        
-        if zeros_count > 0:
-            st.error(f"❌ Please choose numbers between 1-99 (you have {zeros_count} zeros)")
-        elif unique_predictions < len(valid_numbers):
-            st.warning(f"⚠️ You have only {unique_predictions} unique numbers. Duplicates won't increase your chances!")
-        elif len(valid_numbers) < 10:
-            st.error("❌ Please enter all 10 predictions")
+        if st.session_state.user_email:
+            # Returning player - their details are reused, so results follow straight away
+            col1, col2 = st.columns([4, 1])
+            with col1:
+                st.caption(f"Playing as **{st.session_state.user_name}** ({st.session_state.user_email})")
+            with col2:
+                st.button("👤 Switch Player", on_click=clear_keys, args=(PLAYER_KEYS,))
         
-        can_play = zeros_count == 0 and len(valid_numbers) == 10
+        # Input fields for 10 numbers in a nice grid - inside a form so typing
+        # doesn't rerun the whole app until the numbers are submitted
+        with st.form("predictions_form"):
+            cols = st.columns(5)
+            user_numbers = []
+            
+            for i in range(10):
+                col_idx = i % 5
+                with cols[col_idx]:
+                    num = st.number_input(
+                        f"#{i+1}", 
+                        min_value=0, 
+                        max_value=99, 
+                        value=0,
+                        key=f"num_{i}",
+                        help="Choose a number between 1-99"
+                    )
+                    user_numbers.append(num)
+            
+            submitted = st.form_submit_button("🎲 Generate Random Numbers", type="primary", use_container_width=True)
         
-        if st.button("🎲 Generate Random Numbers", type="primary", use_container_width=True, disabled=not can_play):
-            try:
-                with st.spinner("🔮 Generating truly random numbers..."):
-                    random_numbers = random_client.generate_random_numbers(10, 1, 99)
-                    score = calculate_score(user_numbers, random_numbers)
-                    
-                    # Store data in session state
-                    st.session_state.user_numbers = user_numbers
-                    st.session_state.random_numbers = random_numbers
-                    st.session_state.score = score
-                    st.session_state.game_state = 'user_details'
-                    st.rerun()
-                    
-            except Exception as e:
-                st.error(f"❌ Error generating random numbers: {e}")
-                st.info("💡 Please check your internet connection and Random.org API key.")
+        if submitted:
+            # Check for invalid numbers (zeros) - duplicates are counted alongside
+            zeros_count, unique_count = count_zeros_and_unique(user_numbers)
+            
+            if zeros_count > 0:
+                st.error(f"❌ Please choose numbers between 1-99 (you have {zeros_count} zeros)")
+            else:
+                try:
+                    with st.spinner("🔮 Generating truly random numbers..."):
+                        random_numbers = random_client.get_game_numbers()
+                        score = calculate_score(user_numbers, random_numbers)
+                        
+                        # Store data in session state
+                        st.session_state.user_numbers = user_numbers
+                        st.session_state.unique_count = unique_count
+                        st.session_state.random_numbers = random_numbers
+                        st.session_state.score = score
+                        if st.session_state.user_email:
+                            finish_game(supabase)
+                        else:
+                            st.session_state.game_state = 'user_details'
+                        st.rerun()
+                        
+                except Exception as e:
+                    st.error(f"❌ Error generating random numbers: {e}")
+                    st.info("💡 Please check your internet connection and Random.org API key.")
 
     # Phase 2: Collect user details BEFORE showing results
     elif st.session_state.game_state == 'user_details':
@@ -130,37 +197,15 @@ def show_game_tab(supabase: Client, random_client: RandomOrgClient):
                         st.session_state.user_name = name.strip()
                         # Normalize email to lowercase to prevent duplicates
                         st.session_state.user_email = email.strip().lower()
-                        st.session_state.game_state = 'results'
-                        
-                        # Save game run for analytics
-                        save_game_run(
-                            supabase, 
-                            st.session_state.user_name,
-                            st.session_state.user_email,
-                            st.session_state.user_numbers,
-                            st.session_state.random_numbers,
-                            st.session_state.score
-                        )
-                        
-                        # Update leaderboard
-                        update_leaderboard(
-                            supabase,
-                            st.session_state.user_name,
-                            st.session_state.user_email,
-                            st.session_state.score
-                        )
-                        
+                        finish_game(supabase)
                         st.rerun()
                     else:
                         st.error("❌ Please enter both your name and email.")
             
             with col2:
-                if st.form_submit_button("🔄 Start Over", use_container_width=True):
-                    # Reset game state
-                    for key in ['game_state', 'user_numbers', 'random_numbers', 'score', 'user_name', 'user_email']:
-                        if key in st.session_state:
-                            del st.session_state[key]
-                    st.rerun()
+                # Reset game state in a callback, before the rerun the click triggers
+                st.form_submit_button("🔄 Start Over", use_container_width=True,
+                                      on_click=clear_keys, args=(RESET_KEYS | PLAYER_KEYS,))
 
     # Phase 3: Show results
     elif st.session_state.game_state == 'results':
@@ -175,6 +220,9 @@ def show_game_tab(supabase: Client, random_client: RandomOrgClient):
         else:
             st.warning(f"🍀 Better luck next time! Your Score: **{st.session_state.score}/10**")
         
+        if st.session_state.unique_count is not None and st.session_state.unique_count < 10:
+            st.warning(f"⚠️ You had only {st.session_state.unique_count} unique numbers. Duplicates won't increase your chances!")
+        
         # Show comparison
         col1, col2 = st.columns(2)
         
@@ -189,9 +237,8 @@ def show_game_tab(supabase: Client, random_client: RandomOrgClient):
             st.code(rand_display, language=None)
         
         # Show matches
-        matches = [num for num in st.session_state.user_numbers if num in st.session_state.random_numbers]
-        if matches:
-            st.success(f"✅ **Matching numbers:** {', '.join(map(str, matches))}")
+        if st.session_state.matches:
+            st.success(f"✅ **Matching numbers:** {', '.join(map(str, st.session_state.matches))}")
         else:
             st.info("❌ No matches this time - the odds were 1 in 75 million!")
         
@@ -199,24 +246,24 @@ def show_game_tab(supabase: Client, random_client: RandomOrgClient):
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            if st.button("🎮 Play Again", type="primary", use_container_width=True):
-                # Reset game state
-                for key in ['game_state', 'user_numbers', 'random_numbers', 'score']:
-                    if key in st.session_state:
-                        del st.session_state[key]
-                st.rerun()
+            # Reset game state in a callback, before the rerun the click triggers -
+            # the player's details are kept for the next game
+            st.button("🎮 Play Again", type="primary", use_container_width=True,
+                      on_click=clear_keys, args=(RESET_KEYS,))
         
         with col2:
-            if st.button("📊 View My Stats", use_container_width=True):
-                # Switch to user analytics tab
-                st.session_state.active_tab = "👤 My Analytics"
-                st.rerun()
+            # Switch views in a callback - the navigation widget owns active_tab
+            # once it has been drawn, so it can't be changed later in the run
+            st.button("📊 View My Stats", use_container_width=True,
+                      on_click=switch_tab, args=("👤 My Analytics",))
         
         with col3:
-            if st.button("🌍 Global Stats", use_container_width=True):
-                # Switch to global analytics tab
-                st.session_state.active_tab = "📊 Global Analytics"
-                st.rerun()
+            st.button("🌍 Global Stats", use_container_width=True,
+                      on_click=switch_tab, args=("📊 Global Analytics",))
+
+def switch_tab(tab):
+    """Select a view from a button callback"""
+    st.session_state.active_tab = tab
 
 def main():
     # Set page config
@@ -238,9 +285,11 @@ def main():
         
         leaderboard = get_leaderboard(supabase)
         if leaderboard:
-            for i, entry in enumerate(leaderboard, 1):
-                medal = "🥇" if i == 1 else "🥈" if i == 2 else "🥉" if i == 3 else f"**{i}.**"
-                st.markdown(f"{medal} **{entry['name']}** - {entry['best_score']}/10")
+            # One markdown element for the whole list instead of one per row
+            st.markdown("\n\n".join(
+                f"{medal} **{name}** - {best_score}/10"
+                for medal, (name, best_score) in zip(MEDALS, leaderboard)
+            ))
         else:
             st.info("🎯 Be the first to play!")
         
@@ -280,26 +329,22 @@ def main():
     # Main content area with tabs
     st.title("🎯 Random Prediction Game")
     
-    # Tab management
+    # View navigation - unlike st.tabs, only the selected view runs, so the
+    # analytics queries are skipped entirely while playing
     if 'active_tab' not in st.session_state:
         st.session_state.active_tab = "🎮 Play Game"
     
-    tab1, tab2, tab3 = st.tabs(["🎮 Play Game", "📊 Global Analytics", "👤 My Analytics"])
+    active_tab = st.radio(
+        "View", TABS, key="active_tab", horizontal=True, label_visibility="collapsed"
+    )
     
-    with tab1:
-        if st.session_state.active_tab != "🎮 Play Game":
-            st.session_state.active_tab = "🎮 Play Game"
+    if active_tab == "🎮 Play Game":
         show_game_tab(supabase, random_client)
     
-    with tab2:
-        if st.session_state.active_tab != "📊 Global Analytics":
-            st.session_state.active_tab = "📊 Global Analytics"
+    elif active_tab == "📊 Global Analytics":
         show_global_analytics(supabase)
     
-    with tab3:
-        if st.session_state.active_tab != "👤 My Analytics":
-            st.session_state.active_tab = "👤 My Analytics"
-        
+    else:
         # Check if user email is available
         if 'user_email' in st.session_state and st.session_state.user_email:
             show_user_analytics(supabase, st.session_state.user_email)
@@ -308,4 +353,4 @@ def main():
             st.markdown("Your personal statistics will appear here after you play at least one game.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()